@@ -1,13 +1,18 @@
 from __future__ import annotations
 from typing import Tuple, Sequence, Dict, Set
 import abc
+import struct
 import base
 import modules
+import boardfile
 
 
 class Action(abc.ABC):  # modifies a module
-    scope: str  # Module or Editor
+    scope: str  # Module, Editor, Board, Journal, Cell or Repeat
     pos: base.Vec2d
+    journaled: bool = False  # Board actions that change modules, for undo, see cells
+    idempotent: bool = False  # doing it twice in a row is the same as once
+    edits: bool = False  # changes modules, pulses or the history
 
     @abc.abstractmethod
     def do(self, other):
@@ -17,9 +22,20 @@ class Action(abc.ABC):  # modifies a module
     def undo(self, other):
         pass
 
+    def prepare(self, other):  # slow work, done before the engine lock is taken
+        pass
+
+    def finish(self, other):  # slow work, done after the engine lock is released
+        pass
+
+    def repeated(self, count: int) -> Action:  # one action doing it count times
+        return None
+
 
 class changeType(Action):
     scope: str = "Module"
+    idempotent: bool = True
+    edits: bool = True
     target: str
     before: modules.Module
 
@@ -42,50 +58,34 @@ class changeType(Action):
 
 class changeProperty(Action):
     scope: str = "Module"
-    changes: [Tuple[str, str]] = dict()
-    before = None
-    after = None
+    idempotent: bool = True
+    edits: bool = True
+    changes: Dict[str, object]  # property name -> native value
+    before: Dict[str, object] = None
 
-    def __init__(self, changes):
+    def __init__(self, changes: Dict[str, object]):
         self.changes = changes
 
     def do(self, mod: modules.Module, pos: base.Vec2d) -> modules.Module:
         self.pos = pos
-        self.before = mod_props = mod.get_exposed_props()
-        for name, change in self.changes.items():
-            if name in mod_props and self.type_test(change):
-                mod_props[name] = change
-            else:
-                return mod
-        self.after = mod_props
-        mod.set_exposed_props(mod_props)
+        if not all(name in mod.schema for name in self.changes):
+            print(mod.name, "has no property", ", ".join(self.changes))
+            return mod
+        self.before = {name: mod.schema[name].get(mod) for name in self.changes}
+        mod.set_props(self.changes)
         return mod
 
     def undo(self, mod: modules.Module):
-        props = mod.get_exposed_props()
-        if self.before and self.before.keys() == props.keys() \
-                and props() == self.after:
-            mod.set_exposed_props(self.before)
+        current = {name: prop.get(mod) for name, prop in mod.schema.items()
+                   if name in self.changes}
+        if self.before and current == self.changes:
+            mod.set_props(self.before)
             return mod
         else:
             print("tried to undo, but the target props are",
-                  self.before, "while the current are", props)
+                  self.changes, "while the current are", current)
             return None
 
-    def type_test(self, val: Tuple[str, str]) -> bool:
-        if val[1] == "bool":
-            return val[0] == "f" or val[0] == "t"
-        elif val[1] == "int":
-            return val[0].isdigit()
-        elif val[1] == "char":
-            return len(val[0]) == 1
-        elif val[1] == "color":
-            return len(val[0]) > 2 and \
-                tuple(x.strip().isdigit() for x
-                      in val[0][1:-1].split(",")) == (True, True, True)
-        else:
-            print("invalid type:", val[1])
-
 
 class moveCursor(Action):
     scope: str = "Editor"
@@ -100,3 +100,198 @@ class moveCursor(Action):
 
     def undo(self, ed):
         return ed
+
+
+class saveBoard(Action):
+    scope: str = "Board"
+    path: str
+    contents = None  # taken by do, written by finish
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def do(self, b: 'board.Board') -> 'board.Board':
+        self.contents = boardfile.take(b)
+        return b
+
+    def finish(self, b: 'board.Board'):
+        try:
+            boardfile.write(self.path, *self.contents)
+        except OSError as e:
+            print("could not save board to", self.path, e)
+
+    def undo(self, b):
+        return b
+
+
+class loadBoard(Action):
+    scope: str = "Board"
+    journaled: bool = True
+    edits: bool = True
+    path: str
+    contents = None  # (module grid, pulses) built by prepare
+    cells: Dict = None  # the grid packed for the journal, by prepare
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def prepare(self, b: 'board.Board'):
+        try:
+            dim, recs, prec = boardfile.read(self.path)
+            self.contents = boardfile.build(b.dim, recs, prec)
+            self.cells = boardfile.pack_cells(self.contents[0])
+        except (OSError, ValueError, struct.error, IndexError) as e:
+            print("could not load board from", self.path, e)
+
+    def do(self, b: 'board.Board') -> 'board.Board':
+        if self.contents:
+            b.set_contents(*self.contents)
+        return b
+
+    def undo(self, b):
+        return b
+
+
+class panView(Action):
+    scope: str = "Board"
+    direction: base.Vec2d
+
+    def __init__(self, direction: base.Vec2d):
+        self.direction = direction
+
+    def do(self, b: 'board.Board') -> 'board.Board':
+        b.pan(self.direction)
+        return b
+
+    def undo(self, b):
+        return b
+
+
+class setModule(Action):  # puts a given module in place, e.g. for undo
+    scope: str = "Module"
+    idempotent: bool = True
+    edits: bool = True
+    mod: modules.Module
+    before: modules.Module
+
+    def __init__(self, mod: modules.Module):
+        self.mod = mod
+
+    def do(self, mod: modules.Module, pos: base.Vec2d) -> modules.Module:
+        self.pos = pos
+        self.before = mod
+        return self.mod
+
+    def undo(self, mod):
+        return self.before
+
+
+class undoEdit(Action):
+    scope: str = "Journal"
+    edits: bool = True
+    count: int
+
+    def __init__(self, count: int = 1):
+        self.count = count
+
+    def do(self, j: 'journal.Journal', b: 'board.Board') -> 'journal.Journal':
+        j.undo(b, self.count)
+        return j
+
+    def repeated(self, count: int) -> Action:
+        return undoEdit(self.count*count)
+
+    def undo(self, j):
+        return j
+
+
+class redoEdit(Action):
+    scope: str = "Journal"
+    edits: bool = True
+    count: int
+
+    def __init__(self, count: int = 1):
+        self.count = count
+
+    def do(self, j: 'journal.Journal', b: 'board.Board') -> 'journal.Journal':
+        j.redo(b, self.count)
+        return j
+
+    def repeated(self, count: int) -> Action:
+        return redoEdit(self.count*count)
+
+    def undo(self, j):
+        return j
+
+
+class repeatActions(Action):  # a block of actions done count times in a row
+    scope: str = "Repeat"
+    actions: Sequence[Action]
+    count: int
+
+    def __init__(self, actions: Sequence[Action], count: int):
+        self.actions = actions
+        self.count = count
+        self.edits = any(action.edits for action in actions)
+
+    def do(self, other):
+        pass  # unrolled by the engine, see Engine.apply_repeat
+
+    def undo(self, other):
+        pass
+
+
+class atCell(Action):  # a Module action at a given cell instead of the cursor
+    scope: str = "Cell"
+    action: Action
+
+    def __init__(self, pos: base.Vec2d, action: Action):
+        self.pos = pos
+        self.action = action
+        self.idempotent = action.idempotent
+        self.edits = action.edits
+
+    def do(self, other):
+        pass  # applied by the engine at pos
+
+    def undo(self, other):
+        pass
+
+
+def repeat(block: Sequence[Action], count: int = None) -> Sequence[Action]:
+    # the run-length form of block*count
+    if count is None or count == 1 or not block:
+        return list(block)
+    if count == 0:
+        return []
+    if len(block) == 1 and block[0].repeated(count):
+        return [block[0].repeated(count)]
+    return [repeatActions(list(block), count)]
+
+
+# Cursor moves are clamped per axis, so a move is x -> min(max(x + d, lo), hi)
+# and any run of them is again one such function (d, lo, hi).
+def clamped_move(d: int, size: int) -> Tuple[int, int, int]:
+    return (d, 0, size - 1)
+
+
+def compose(f: Tuple[int, int, int], g: Tuple[int, int, int]) -> Tuple[int, int, int]:
+    # g after f
+    d1, lo1, hi1 = f
+    d2, lo2, hi2 = g
+    lo1, hi1 = lo1 + d2, hi1 + d2
+    return (d1 + d2, min(max(lo1, lo2), hi2), max(min(hi1, hi2), lo2))
+
+
+def power(f: Tuple[int, int, int], n: int) -> Tuple[int, int, int]:
+    result = (0, -float("inf"), float("inf"))  # identity
+    while n:
+        if n & 1:
+            result = compose(result, f)
+        f = compose(f, f)
+        n >>= 1
+    return result
+
+
+def apply_move(f: Tuple[int, int, int], x: int) -> int:
+    return min(max(x + f[0], f[1]), f[2])
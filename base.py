@@ -1,5 +1,6 @@
 from __future__ import annotations
 from typing import Tuple, Sequence, Dict
+import numpy as np
 import tcod
 import tcod.event
 from random import randint
@@ -9,18 +10,31 @@ from collections import namedtuple
 # ---tcod init--- #
 SCREEN_WIDTH = 192
 SCREEN_HEIGHT = 108
-LIMIT_FPS = 30
+LIMIT_FPS = 30  # while typing, main.py only draws frames that changed
+IDLE_FPS = 10  # otherwise, beats and pulses need no more
+STATUS_INTERVAL = 1.0  # seconds, redraws the fps and jitter line when nothing else does
 STEP = 0.2
+board_path = "board.ilo"  # saved with "." and loaded with ","
+SIM_BACKEND = "object"  # "object", "numpy", "event" or "shards", see Board.set_backend
+BOARD_SIZE = None  # Vec2d in blocks, None fits the board to the screen
+LOOKAHEAD = 8  # beats simulated ahead of the clock, 0 for none, see lookahead
+MIDI_DISPATCH = True  # send midi from a separate process, see mididispatch
 
 font_path = 'terminal10x10_gs_tc.png'
 font_flags = tcod.FONT_TYPE_GREYSCALE | tcod.FONT_LAYOUT_TCOD
-tcod.console_set_custom_font(font_path, font_flags)
 window_title = 'ilomusi'
 fullscreen = True
-root_console = tcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT,
-                                      window_title, fullscreen,
-                                      tcod.RENDERER_SDL2, order="F", vsync=False)
-tcod.sys_set_fps(LIMIT_FPS)
+# offscreen until init_display, which is all a headless run needs
+root_console = tcod.console.Console(SCREEN_WIDTH, SCREEN_HEIGHT, order="F")
+
+
+def init_display():  # opens the window, call once at startup
+    global root_console
+    tcod.console_set_custom_font(font_path, font_flags)
+    root_console = tcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT,
+                                          window_title, fullscreen,
+                                          tcod.RENDERER_SDL2, order="F", vsync=False)
+    tcod.sys_set_fps(0)  # main.py paces the frames
 # colors: http://roguecentral.org/doryen/data/libtcod/doc/1.5.1/html2/color.html?c=false&cpp=false&cs=false&py=true&lua=false
 
 
@@ -35,6 +49,7 @@ Color = Tuple[int, int, int]
 
 
 class Vec2d():
+    __slots__ = ("x", "y")
     x: int
     y: int
 
@@ -59,17 +74,71 @@ class Vec2d():
     def mul(self, n: int):
         return Vec2d(self.x*n, self.y*n)
 
+    def shift(self, other: Vec2d):  # in place, only for vectors you own
+        self.x += other.x
+        self.y += other.y
+
     def __add__(self, other: Vec2d):
         return Vec2d(self.x + other.x, self.y + other.y)
 
     def __eq__(self, other):
         return (self.x == other.x) and (self.y == other.y)
 
+    def __hash__(self):
+        return hash((self.x, self.y))
 
+
+# shared direction instances, never shift these
 DIR_UP = Vec2d(0, -1)
 DIR_RIGHT = Vec2d(1, 0)
 DIR_DOWN = Vec2d(0, 1)
 DIR_LEFT = Vec2d(-1, 0)
+DIRS = (DIR_UP, DIR_DOWN, DIR_LEFT, DIR_RIGHT)  # in prop order
+
+
+def dir_slot(direction: Vec2d) -> int:  # 3, 5, 1, 7 for DIRS, see Module.transfer
+    return 3*direction.x + direction.y + 4
+
+
+# direction codes are indices into DIRS, the backends and files use them
+DX = (0, 0, -1, 1)
+DY = (-1, 1, 0, 0)
+
+
+def dir_code(direction: Vec2d) -> int:
+    return 2 + (direction.x + 1)//2 if direction.x else (direction.y + 1)//2
+
+
+def dir_codes(dxs: np.ndarray, dys: np.ndarray) -> np.ndarray:  # dir_code per element
+    return np.where(dxs == 0, (dys + 1)//2, 2 + (dxs + 1)//2)
+
+
+def dir_mask(directions: Sequence[Vec2d]) -> int:  # one bit per direction code
+    mask = 0
+    for d in directions:
+        mask |= 1 << dir_code(d)
+    return mask
+
+
+def mask_dirs(mask: int) -> Sequence[Vec2d]:
+    return [d for i, d in enumerate(DIRS) if mask >> i & 1]
+
+
+# a pulse as one int64, (x*height + y)*4 + direction code, so sorted keys
+# compare boards whatever order their pulses are in
+def pulse_keys(xs: np.ndarray, ys: np.ndarray, ds: np.ndarray, height: int) -> np.ndarray:
+    return (xs.astype(np.int64)*height + ys)*4 + ds
+
+
+def key_parts(keys: np.ndarray, height: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # xs, ys and direction codes, in the dtypes of VectorSim
+    cells, ds = np.divmod(keys, 4)
+    xs, ys = np.divmod(cells, height)
+    return xs.astype(np.int32), ys.astype(np.int32), ds.astype(np.int8)
+
+
+def key_xs(keys: np.ndarray, height: int) -> np.ndarray:
+    return keys//4//height
 
 prompt = "(ilomusi):> "
 underline_char = "="
@@ -0,0 +1,271 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict, Callable
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tcod
+import base
+import board
+import pulse
+import actions
+import engine
+import clock
+import lookahead
+import midi
+import mididispatch
+import control
+import shardsim
+
+# Headless benchmarks for the hot paths. Results are written as json, and
+# a previous run can be passed with --compare to print the ratios.
+#   python bench.py --out bench.json
+#   python bench.py --compare bench.json
+
+sizes = {  # in blocks
+    "small": (20, 15),
+    "screen": (41, 34),
+    "large": (120, 100),
+}
+densities = {  # share of cells that are emitters, spreaders, outputs
+    "sparse": (0.01, 0.03, 0.02),
+    "dense": (0.03, 0.12, 0.04),
+}
+
+
+def synthetic_board(w: int, h: int, density: Tuple[float, float, float],
+                    pulses: int = 0, seed: int = 1,
+                    backend: str = "object") -> board.Board:
+    b = board.Board(tcod.console.Console(w*3, h*3, order="F"), 0,
+                    base.Vec2d(w*3, h*3), backend="object")
+    r = random.Random(seed)
+    emitters, spreaders, outputs = density
+    for x in range(w):
+        for y in range(h):
+            v = r.random()
+            if v < emitters:
+                b.do_action(actions.changeType("emitter"), base.Vec2d(x, y))
+                mod = b.module_at(x, y)
+                mod.interval = r.randint(2, 8)
+                mod.outp = [d for d in base.DIRS if r.random() < 0.5]
+            elif v < emitters + spreaders:
+                b.do_action(actions.changeType("spreader"), base.Vec2d(x, y))
+                mod = b.module_at(x, y)
+                mod.inp = [d for d in base.DIRS if r.random() < 0.7]
+                mod.outp = [d for d in base.DIRS if r.random() < 0.4]
+            elif v < emitters + spreaders + outputs:
+                b.do_action(actions.changeType("output"), base.Vec2d(x, y))
+    b.pulses = [pulse.Pulse(base.Vec2d(r.randrange(w), r.randrange(h)),
+                            r.choice(base.DIRS)) for i in range(pulses)]
+    b.set_backend(backend)
+    return b
+
+
+def timed(fn: Callable[[], None], min_time: float = 0.5) -> Tuple[int, float]:
+    # runs fn until min_time has passed, returns (calls, seconds)
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return calls, elapsed
+
+
+def bench_ticks(results: Dict, min_time: float):
+    for size, (w, h) in sizes.items():
+        for density_name, density in densities.items():
+            for pulses in (0, 1000):
+                for backend in ("object", "numpy", "event"):
+                    b = synthetic_board(w, h, density, pulses, backend=backend)
+                    beats = [0]
+
+                    def tick():
+                        beats[0] += 1
+                        b.update(beats[0])
+                    calls, elapsed = timed(tick, min_time)
+                    key = "tick/%s/%s/%d/%s" % (size, density_name, pulses, backend)
+                    results[key] = {"ticks_per_second": calls/elapsed,
+                                    "pulses_after": len(b.get_pulses())}
+
+
+def bench_shards(results: Dict, min_time: float):
+    # scaling of the shards backend with the worker count, against numpy in
+    # one process; only meaningful with at least that many cores, rows
+    # without them say enough_cpus: 0
+    w, h = 400, 300
+    for workers in (0, 1, 2, 4, 8):
+        shardsim.WORKERS = workers
+        b = synthetic_board(w, h, densities["dense"], 20000,
+                            backend="shards" if workers else "numpy")
+        beats = [0]
+
+        def tick():
+            beats[0] += 1
+            b.update(beats[0])
+        calls, elapsed = timed(tick, min_time)
+        key = "shards/%d" % workers if workers else "shards/numpy"
+        results[key] = {"ticks_per_second": calls/elapsed,
+                        "pulses_after": b.pulse_count, "cpus": os.cpu_count(),
+                        "enough_cpus": workers <= os.cpu_count()}
+        b.close()
+    shardsim.WORKERS = 4
+
+
+def bench_allocations(results: Dict):
+    # allocated blocks left over by stepping pass-through pulses once,
+    # should stay flat as the pulse count grows (this leaves out the
+    # position snapshot Board.update publishes for the renderer)
+    for pulses in (100, 1000, 10000):
+        b = synthetic_board(300, 300, (0, 0, 0), 0)
+        b.pulses = [pulse.Pulse(base.Vec2d(i % 200, i//200 % 200),
+                                base.DIR_RIGHT if i % 2 else base.DIR_DOWN)
+                    for i in range(pulses)]
+
+        def step(beat):
+            new_pulses = b.step_pulses(b.pulses, beat, b.spare_pulses)
+            b.spare_pulses = b.pulses
+            b.pulses = new_pulses
+        for beat in range(1, 4):
+            step(beat)
+        gc.disable()
+        before = sys.getallocatedblocks()
+        step(4)
+        after = sys.getallocatedblocks()
+        gc.enable()
+        results["alloc/%d" % pulses] = {"blocks_per_tick": after - before}
+
+
+def bench_render(results: Dict, min_time: float):
+    for size, (w, h) in sizes.items():
+        b = synthetic_board(w, h, densities["dense"], 1000)
+        cursor = base.Vec2d(0, 0)
+
+        def full():
+            b.invalidate()
+            b.render(cursor)
+        calls, elapsed = timed(full, min_time)
+        results["render/full/%s" % size] = {"frame_ms": 1000*elapsed/calls}
+
+        beats = [0]
+
+        def incremental():
+            beats[0] += 1
+            b.update(beats[0])
+            b.render(cursor)
+        b.render(cursor)
+        calls, elapsed = timed(incremental, min_time)
+        results["render/tick/%s" % size] = {"frame_ms": 1000*elapsed/calls}
+
+
+def bench_commands(results: Dict, min_time: float):
+    eng = engine.Engine()
+    for cmd in ("l", "20l", "q", "wlwh", "500l", "20l20h", "5000lq"):
+        def run():
+            eng.do_actions(eng.editor.exec_command(cmd))
+        calls, elapsed = timed(run, min_time)
+        results["command/%s" % cmd] = {"commands_per_second": calls/elapsed}
+
+
+def bench_control(results: Dict, min_time: float):
+    # pipelined cell edits through the control socket
+    eng = engine.Engine()
+    server = control.ControlServer(eng)
+    server.start(tempfile.mktemp(suffix=".sock"))
+    sock = control.connect(server.address)
+    dim = eng.board.dim
+    requests = [{"id": i, "do": [{"op": "type", "x": i % dim.x, "y": i//dim.x % dim.y,
+                                  "type": ("spreader", "empty")[i % 2]}]}
+                for i in range(200)]
+    calls, elapsed = timed(lambda: control.send(sock, requests), min_time)
+    stats = server.stats()
+    results["control/cell_ops"] = {"requests_per_second": calls*len(requests)/elapsed,
+                                   "p50_ms": stats["p50"], "p99_ms": stats["p99"]}
+    sock.close()
+
+
+def bench_lookahead(results: Dict, min_time: float):
+    # how late the notes start against their beat, on a board whose ticks
+    # take a while, with hitches in the main thread, without and with
+    # lookahead
+    for beats in (0, base.LOOKAHEAD):
+        live = midi.midi
+        midi.midi = midi.Midi(scheduler=mididispatch.RingScheduler(midi.RecordingMidiOut))
+        time.sleep(1)  # the dispatcher starting up
+        eng = engine.Engine()
+        eng.board = synthetic_board(120, 100, densities["dense"], 1000)
+        eng.clock = clock.BeatClock(eng.tick, step=0.05)
+        eng.lookahead = lookahead.Lookahead(eng.clock, beats)
+        eng.start()
+        end = time.perf_counter() + max(4.0, 8*min_time)
+        while time.perf_counter() < end:
+            hitch = time.perf_counter() + 0.02
+            while time.perf_counter() < hitch:
+                pass
+            time.sleep(0.05)
+        eng.clock.stop()
+        time.sleep(0.5)  # the last scheduled notes
+        step = eng.clock.step
+        late = [((t - eng.clock.origin + step/2) % step - step/2)
+                for t, message in midi.midi.scheduler.close() if message[0] & 0xf0 == 0x90]
+        p50, p95 = clock.percentiles(late, (50, 95))
+        results["lookahead/%d" % beats] = {
+            "notes": len(late), "p50_ms": 1000*p50, "p95_ms": 1000*p95,
+            "max_ms": 1000*max(late) if late else 0.0,
+            "tick_p95_ms": eng.clock.jitter_stats()["p95"]}
+        midi.midi = live
+
+
+def compare(results: Dict, previous: Dict):
+    for key, values in results.items():
+        if key not in previous:
+            continue
+        for name, value in values.items():
+            old = previous[key].get(name)
+            if old:
+                print("%-40s %-20s %12.3f -> %12.3f  (x%.2f)"
+                      % (key, name, old, value, value/old))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ilomusi benchmarks")
+    parser.add_argument("--out", help="write results to this json file")
+    parser.add_argument("--compare", help="json file of an earlier run")
+    parser.add_argument("--min-time", type=float, default=0.5,
+                        help="seconds per measurement")
+    parser.add_argument("--only", help="comma separated: ticks,shards,alloc,render,commands,control,lookahead")
+    args = parser.parse_args()
+
+    suites = {
+        "ticks": lambda r: bench_ticks(r, args.min_time),
+        "shards": lambda r: bench_shards(r, args.min_time),
+        "alloc": bench_allocations,
+        "render": lambda r: bench_render(r, args.min_time),
+        "commands": lambda r: bench_commands(r, args.min_time),
+        "control": lambda r: bench_control(r, args.min_time),
+        "lookahead": lambda r: bench_lookahead(r, args.min_time),
+    }
+    only = args.only.split(",") if args.only else suites.keys()
+    results = {}
+    for name in only:
+        suites[name](results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+    else:
+        for key, values in results.items():
+            print("%-40s %s" % (key, ", ".join("%s: %.3f" % kv for kv in values.items())))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"time": time.time(), "python": sys.version,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
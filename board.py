@@ -1,115 +1,368 @@
 from __future__ import annotations
-from typing import Tuple, Sequence, Dict, Set
+from typing import Tuple, Sequence, Dict, Set, FrozenSet
 import abc
+import numpy as np
 import tcod
 import base
 import modules
 import pulse
 import actions
+import vecsim
+import eventsim
+import shardsim
+import tiles
+import midi
+
+# offsets of the nine cells of a chunk
+tile_x, tile_y = np.indices((3, 3))
+minimap_chars = " .:+*#"
+PASS = object()  # transfer marker of cells that pass pulses on
 
 
 class Board():
-    modules: Sequence[Sequence[modules.Module]]
+    # only non-Empty modules are stored, every other cell is self.empty
+    modules: Dict[Tuple[int, int], modules.Module]
+    empty: modules.Empty
     con: tcod.console.Console = None
     con_pos: base.Vec2d
     con_dim: base.Vec2d  # dimensions in characters
     con_offset: base.Vec2d = 3
     dim: base.Vec2d  # dimensions in blocks
+    view_dim: base.Vec2d  # blocks that fit on the console
+    view: base.Vec2d  # top left block of the viewport
+    view_margin: int = 3  # blocks kept between the cursor and the edge
+    show_minimap: bool = True  # only drawn if the board doesn't fit, F2
+    minimap_dim: base.Vec2d = base.Vec2d(24, 16)  # in characters
+    minimap: np.ndarray = None  # cached characters
+    minimap_pulses: Set[Tuple[int, int]] = None  # snapshot it was built from
+    minimap_modules: int = 0
     pulses: Sequence[pulse.Pulse] = []
+    spare_pulses: Sequence[pulse.Pulse]  # reused as the next tick's list
+    seen_pulses: Set[pulse.Pulse]  # de-duplication within a tick
     active_modules: Set[Tuple[int, int]] = set()
+    # Module.transfer per cell, None for modules that need on_pulse and
+    # absent for cells that just pass pulses on
+    transfer: Dict[Tuple[int, int], Sequence[Tuple[Sequence[base.Vec2d], tuple]]]
+    pulse_snapshot: FrozenSet[Tuple[int, int]] = frozenset()  # as of the last update
+    pulse_count: int = 0
+    sim: vecsim.VectorSim = None  # numpy, event or shards backend, if selected
+    # what changed since the last render:
+    full_redraw: bool = True
+    dirty: Set[Tuple[int, int]]
+    drawn_pulses: Set[Tuple[int, int]]
+    drawn_cursor: Tuple[int, int] = (0, 0)
 
-    def __init__(self, con: tcod.console.Console, con_pos: base.Vec2d, con_dim: base.Vec2d):
+    def __init__(self, con: tcod.console.Console, con_pos: base.Vec2d, con_dim: base.Vec2d,
+                 backend: str = base.SIM_BACKEND, dim: base.Vec2d = None):
         self.con = con
         self.con.default_bg = base.cols["bg"]
         self.con.default_fg = base.cols["fg"]
         self.con_dim = con_dim
         self.con_pos = con_pos
-        self.dim = base.Vec2d(self.con_dim.x//3,
-                              self.con_dim.y//3)
+        self.view_dim = base.Vec2d(self.con_dim.x//3,
+                                   self.con_dim.y//3)
+        # the board may be larger than what fits on the console
+        self.dim = dim if dim else self.view_dim
+        self.view = base.Vec2d(0, 0)
+
+        self.modules = {}
+        self.empty = modules.Empty(base.Vec2d(0, 0))
+        self.pulses = []
+        self.spare_pulses = []
+        self.seen_pulses = set()
+        self.active_modules = set()
+        self.transfer = {}
+        self.dirty = set()
+        self.drawn_pulses = set()
+        self.set_backend(backend)
+
+    def set_backend(self, backend: str):
+        # also recompiles everything derived from the modules
+        self.transfer = {}
+        for key in self.modules:
+            self.compile_cell(key)
+        pulses = self.get_pulses()
+        self.close()
+        if backend == "numpy":
+            self.sim = vecsim.VectorSim(self)
+            self.sim.set_pulses(pulses)
+        elif backend == "event":
+            self.sim = eventsim.EventSim(self)
+            self.sim.set_pulses(pulses)
+        elif backend == "shards":
+            self.sim = shardsim.ShardSim(self)
+            self.sim.set_pulses(pulses)
+        elif backend == "object":
+            self.sim = None
+            self.pulses = pulses
+        else:
+            print("invalid simulation backend", backend)
+        self.pulse_snapshot = self.get_pulse_positions()
+
+    def module_at(self, x: int, y: int) -> modules.Module:
+        return self.modules.get((x, y), self.empty)
+
+    def get_pulses(self) -> Sequence[pulse.Pulse]:
+        if self.sim:
+            return self.sim.get_pulses()
+        return self.pulses
+
+    def get_pulse_positions(self) -> FrozenSet[Tuple[int, int]]:
+        if self.sim:
+            return self.sim.get_pulse_positions()
+        return frozenset([(p.pos.x, p.pos.y) for p in self.pulses])
 
-        self.modules = []
-        for x in range(self.dim.x):
-            new_column = []
-            for y in range(self.dim.y):
-                new_column.append(modules.Empty(base.Vec2d(x, y)))
-            self.modules.append(new_column)
+    def get_pulse_state(self) -> np.ndarray:
+        # sorted base.pulse_keys, equal for any two boards whose pulses only
+        # differ in order
+        if isinstance(self.sim, vecsim.VectorSim):
+            xs, ys, ds = self.sim.xs, self.sim.ys, self.sim.ds
+        elif isinstance(self.sim, shardsim.ShardSim):
+            return np.sort(self.sim.keys())
+        else:
+            pulses = self.get_pulses()
+            n = len(pulses)
+            xs = np.fromiter((p.pos.x for p in pulses), np.int64, n)
+            ys = np.fromiter((p.pos.y for p in pulses), np.int64, n)
+            dxs = np.fromiter((p.direction.x for p in pulses), np.int64, n)
+            dys = np.fromiter((p.direction.y for p in pulses), np.int64, n)
+            ds = base.dir_codes(dxs, dys)
+        return np.sort(base.pulse_keys(xs, ys, ds, self.dim.y))
+
+    def set_pulse_state(self, state: np.ndarray):  # see get_pulse_state
+        xs, ys, ds = base.key_parts(state, self.dim.y)
+        if isinstance(self.sim, vecsim.VectorSim):
+            self.sim.xs, self.sim.ys, self.sim.ds = xs, ys, ds
+        elif isinstance(self.sim, shardsim.ShardSim):
+            self.sim.set_keys(state)
+        else:
+            pulses = [pulse.Pulse(base.Vec2d(x, y), base.DIRS[d]) for x, y, d
+                      in zip(xs.tolist(), ys.tolist(), ds.tolist())]
+            if self.sim:
+                self.sim.set_pulses(pulses)
+            else:
+                self.pulses = pulses
+                self.spare_pulses = []
+        self.pulse_snapshot = self.get_pulse_positions()
+        self.pulse_count = len(state)
 
     def update(self, beats: int):
-        new_pulses = []
-        for p in self.pulses:
-            nnps = self.modules[p.pos.x][p.pos.y].on_pulse(p)
-            nnps = [p for p in nnps if p.pos.is_inner(self.dim)
-                    and p not in new_pulses]
-            new_pulses += nnps
+        if self.sim:
+            self.sim.update(beats)
+        else:
+            # the two pulse lists are swapped every tick instead of reallocated
+            new_pulses = self.step_pulses(self.pulses, beats, self.spare_pulses)
+            self.spare_pulses = self.pulses
+            self.pulses = new_pulses
+        self.pulse_snapshot = self.get_pulse_positions()
+        self.pulse_count = self.sim.count() if self.sim else len(self.pulses)
+
+    def step_pulses(self, pulses: Sequence[pulse.Pulse], beats: int,
+                    new_pulses: Sequence[pulse.Pulse] = None) -> Sequence[pulse.Pulse]:
+        new_pulses = [] if new_pulses is None else new_pulses
+        new_pulses.clear()
+        seen = self.seen_pulses
+        seen.clear()
+        transfer = self.transfer
+        for p in pulses:
+            pos = p.pos
+            table = transfer.get((pos.x, pos.y), PASS)
+            if table is PASS:
+                # plain pass-through, moved in place without a result list
+                p.move()
+                if pos.is_inner(self.dim) and p not in seen:
+                    seen.add(p)
+                    new_pulses.append(p)
+                continue
+            if table is None:
+                out_pulses = self.modules[(pos.x, pos.y)].on_pulse(p)
+            else:
+                d = p.direction
+                outs, note = table[3*d.x + d.y + 4]  # base.dir_slot
+                if note:
+                    midi.midi.queue_note(*note)
+                # the incoming pulse is reused for the last output
+                out_pulses = [pulse.Pulse(pos, o) for o in outs[:-1]]
+                if outs:
+                    p.direction = outs[-1]
+                    out_pulses.append(p)
+                for new_pulse in out_pulses:
+                    new_pulse.move()
+            for new_pulse in out_pulses:
+                if new_pulse.pos.is_inner(self.dim) and new_pulse not in seen:
+                    seen.add(new_pulse)
+                    new_pulses.append(new_pulse)
+        seen.clear()
 
         # sources
         for x, y in self.active_modules:
-            new_pulses += self.modules[x][y].on_beat(beats)
-
-        self.pulses = new_pulses
-
-    def render(self, cursor):
-
-        def draw_chunk(chunk: base.Chunk, pos: base.Vec2d,
-                       fg: base.Color = None, bg: base.Color = None):
-            render_pos = pos.mul(3)
-            if not chunk:
-                self.con.default_fg = self.con.default_bg = self.con.default_bg if not bg else bg
-                self.con.draw_frame(render_pos.x, render_pos.y, 3, 3,
-                                    fg=self.con.default_fg,
-                                    bg=self.con.default_bg, clear=True)
-                self.con.default_fg = base.cols["inactive"] if not fg else fg
-                tcod.console_put_char(self.con, render_pos.x+1,
-                                      render_pos.y+1, "=", tcod.BKGND_SET)
-                self.con.default_fg = base.cols["fg"]
-                self.con.default_bg = base.cols["bg"]
-                return
-
-            self.con.default_fg = chunk[1][1][1] if not fg else fg
-            self.con.default_bg = chunk[1][1][2] if not bg else bg
-            self.con.draw_frame(render_pos.x, render_pos.y, 3, 3,
-                                fg=self.con.default_fg,
-                                bg=self.con.default_bg)
-            for x in range(3):
-                for y in range(3):
-                    if chunk[x][y]:
-                        self.con.default_fg = chunk[x][y][1] if not fg else fg
-                        tcod.console_put_char(self.con, render_pos.x+x,
-                                              render_pos.y+y,
-                                              chunk[x][y][0], tcod.BKGND_SET)
-                        self.con.default_fg = base.cols["fg"]
-            self.con.default_bg = base.cols["bg"]
-
-        pulse_positions = [p.pos.to_tuple() for p in self.pulses]
-        self.con.clear()
-        for x, column in enumerate(self.modules):
-            for y, module in enumerate(column):
-                if cursor == base.Vec2d(x, y):
-                    draw_chunk(module.get_chunk(),
-                               module.pos, bg=base.cols["cursor_bg"],
-                               fg=base.cols["cursor_fg"])
+            new_pulses += self.modules[(x, y)].on_beat(beats)
+
+        return new_pulses
+
+    def take_changes(self) -> Tuple[Set[Tuple[int, int]], bool]:
+        # (cells edited since the last render, whether all are), edits may
+        # come from another thread, so the engine takes them under its lock
+        changes = (self.dirty, self.full_redraw)
+        self.dirty = set()
+        self.full_redraw = False
+        return changes
+
+    def render(self, cursor, changes: Tuple[Set[Tuple[int, int]], bool] = None):
+        # pulses may be moving on the clock thread, only read the snapshot
+        pulse_positions = self.pulse_snapshot
+        dirty, full_redraw = changes or self.take_changes()
+        cursor_pos = cursor.to_tuple()
+        # only the chunks inside the viewport are ever drawn
+        x0, y0 = self.view.x, self.view.y
+        x1 = min(x0 + self.view_dim.x, self.dim.x)
+        y1 = min(y0 + self.view_dim.y, self.dim.y)
+        if full_redraw:
+            self.con.clear()
+            cells = [(x, y) for x in range(x0, x1) for y in range(y0, y1)]
+        else:
+            cells = dirty
+            cells |= pulse_positions ^ self.drawn_pulses
+            if cursor_pos != self.drawn_cursor:
+                cells.add(self.drawn_cursor)
+                cells.add(cursor_pos)
+            cells = [(x, y) for x, y in cells
+                     if x0 <= x < x1 and y0 <= y < y1]
+
+        if cells:
+            ids = []
+            for x, y in cells:
+                if cursor_pos == (x, y):
+                    state = tiles.CURSOR
                 elif (x, y) in pulse_positions:
-                    draw_chunk(module.get_chunk(),
-                               module.pos, bg=base.cols["pulse_bg"],
-                               fg=base.cols["pulse_fg"])
+                    state = tiles.PULSE
                 else:
-                    draw_chunk(module.get_chunk(), module.pos)
+                    state = tiles.NORMAL
+                ids.append(tiles.cache.get_ids(self.module_at(x, y))[state])
+            cells = np.array(cells, dtype=np.int32)
+            xs, ys = cells[:, 0] - x0, cells[:, 1] - y0
+
+            # the board console is in "F" order, so arrays are indexed [x, y]
+            cx = xs[:, None, None]*3 + tile_x
+            cy = ys[:, None, None]*3 + tile_y
+            self.con.ch[cx, cy] = tiles.cache.ch[ids]
+            self.con.fg[cx, cy] = tiles.cache.fg[ids]
+            self.con.bg[cx, cy] = tiles.cache.bg[ids]
+
+        self.drawn_pulses = pulse_positions
+        self.drawn_cursor = cursor_pos
         self.con.blit(base.root_console,
                       self.con_pos + self.con_offset, self.con_offset)
+        if self.show_minimap and not self.fits_view():
+            self.render_minimap(pulse_positions)
+
+    def fits_view(self) -> bool:
+        return self.dim.x <= self.view_dim.x and self.dim.y <= self.view_dim.y
+
+    def follow(self, cursor: base.Vec2d):
+        # scrolls just far enough to keep the cursor a margin away from the edge
+        margin = base.Vec2d(min(self.view_margin, (self.view_dim.x-1)//2),
+                            min(self.view_margin, (self.view_dim.y-1)//2))
+        view = base.Vec2d(
+            min(max(self.view.x, cursor.x + margin.x - self.view_dim.x + 1),
+                cursor.x - margin.x),
+            min(max(self.view.y, cursor.y + margin.y - self.view_dim.y + 1),
+                cursor.y - margin.y))
+        self.set_view(view)
+
+    def pan(self, direction: base.Vec2d):  # by a third of the viewport
+        self.set_view(self.view + base.Vec2d(direction.x*max(1, self.view_dim.x//3),
+                                             direction.y*max(1, self.view_dim.y//3)))
+
+    def set_view(self, view: base.Vec2d):
+        view = base.Vec2d(max(0, min(view.x, self.dim.x - self.view_dim.x)),
+                          max(0, min(view.y, self.dim.y - self.view_dim.y)))
+        if view != self.view:
+            self.view = view
+            self.invalidate()
+
+    def render_minimap(self, pulse_positions: Set[Tuple[int, int]]):
+        # one character per region of the board, brighter where more is going
+        # on, drawn over the bottom right corner of the board
+        if pulse_positions is not self.minimap_pulses or \
+                len(self.modules) != self.minimap_modules:
+            w, h = self.minimap_dim.x, self.minimap_dim.y
+            counts = np.zeros((w, h), dtype=np.int32)
+            for positions in (self.modules.keys(), pulse_positions):
+                if positions:
+                    xy = np.array(list(positions), dtype=np.int64)
+                    np.add.at(counts, (xy[:, 0]*w//self.dim.x,
+                                       xy[:, 1]*h//self.dim.y), 1)
+            levels = np.minimum(counts, len(minimap_chars) - 1)
+            self.minimap = np.array([ord(c) for c in minimap_chars])[levels]
+            self.minimap_pulses = pulse_positions
+            self.minimap_modules = len(self.modules)
+
+        w, h = self.minimap_dim.x, self.minimap_dim.y
+        left = self.con_pos + self.con_offset + self.con_dim.x - w
+        top = self.con_offset + self.con_dim.y - h
+        base.root_console.ch[left:left+w, top:top+h] = self.minimap
+        base.root_console.fg[left:left+w, top:top+h] = base.cols["fg"]
+        base.root_console.bg[left:left+w, top:top+h] = base.cols["bg"]
+        # the viewport
+        vx0, vy0 = self.view.x*w//self.dim.x, self.view.y*h//self.dim.y
+        vx1 = max(vx0+1, (self.view.x + self.view_dim.x)*w//self.dim.x)
+        vy1 = max(vy0+1, (self.view.y + self.view_dim.y)*h//self.dim.y)
+        base.root_console.bg[left+vx0:left+vx1, top+vy0:top+vy1] = base.cols["cursor_bg"]
 
     def do_action(self, action: actions.Action, pos: base.Vec2d) -> actions.Action:
-        if self.modules[pos.x][pos.y].active:
-            self.active_modules.remove((pos.x, pos.y))
+        key = (pos.x, pos.y)
+        if self.module_at(*key).active:
+            self.active_modules.remove(key)
+
+        mod = action.do(self.module_at(*key), pos)
+        if isinstance(mod, modules.Empty):
+            self.modules.pop(key, None)
+        else:
+            self.modules[key] = mod
 
-        self.modules[pos.x][pos.y] = action.do(self.modules[pos.x][pos.y], pos)
+        if mod.active:
+            self.active_modules.add(key)
 
-        if self.modules[pos.x][pos.y].active:
-            self.active_modules.add((pos.x, pos.y))
+        self.compile_cell(key)
+        if self.sim:
+            self.sim.on_cell_changed(pos)
+        self.dirty.add(key)
 
         return action
 
-    def get_prop_at(self, pos: base.Vec2d):
-        return self.modules[pos.x][pos.y].get_exposed_props()
+    def compile_cell(self, key: Tuple[int, int]):
+        mod = self.modules.get(key)
+        if mod is None or type(mod).on_pulse is modules.Module.on_pulse:
+            self.transfer.pop(key, None)
+        elif modules.compiles(type(mod)):
+            self.transfer[key] = mod.transfer()
+        else:
+            self.transfer[key] = None
+
+    def set_contents(self, modules: Dict[Tuple[int, int], modules.Module],
+                     pulses: Sequence[pulse.Pulse]):
+        # swaps in a whole prepared set of modules, e.g. a loaded board
+        self.modules = modules
+        self.active_modules = set(key for key, mod in modules.items()
+                                  if mod.active)
+        self.transfer = {}
+        for key in modules:
+            self.compile_cell(key)
+        self.pulses = list(pulses)
+        self.spare_pulses = []
+        if isinstance(self.sim, shardsim.ShardSim):
+            self.sim.load(self.pulses)  # keeps the worker processes
+        elif self.sim:
+            self.sim = type(self.sim)(self)
+        self.pulse_snapshot = self.get_pulse_positions()
+        self.pulse_count = len(self.pulses)
+        self.invalidate()
+
+    def close(self):  # stops the worker processes of the shards backend
+        if isinstance(self.sim, shardsim.ShardSim):
+            self.sim.close()
+            self.sim = None
 
-    def get_name_at(self, pos: base.Vec2d):
-        return self.modules[pos.x][pos.y].name
+    def invalidate(self):  # repaint everything on the next render
+        self.full_redraw = True
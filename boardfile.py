@@ -0,0 +1,143 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict
+import mmap
+import os
+import struct
+import numpy as np
+import tcod
+import base
+import board
+import modules
+import pulse
+
+# Binary board files, little endian:
+#   header: magic, version, board width and height in blocks,
+#           number of module records, number of pulse records
+#   module records (non-Empty cells only), then pulse records
+# Records are fixed size so a whole section is read with one frombuffer.
+# Version 1 files, with 16 bit intervals and offsets, are still read.
+
+MAGIC = b"ILOB"
+VERSION = 2
+header = struct.Struct("<4sHHHII")
+
+module_dtype = np.dtype([
+    ("x", "<u2"), ("y", "<u2"),
+    ("kind", "u1"),  # index into modules.names
+    ("active", "u1"),
+    ("char", "<u4"),  # code point of the central symbol
+    ("color", "u1", 3),
+    ("inp", "u1"), ("outp", "u1"),  # direction bits, in base.DIRS order
+    ("interval", "<u4"), ("offset", "<u4"),  # see props.IntType.maximum
+])
+module_dtype_v1 = np.dtype([
+    ("x", "<u2"), ("y", "<u2"), ("kind", "u1"), ("active", "u1"), ("char", "<u4"),
+    ("color", "u1", 3), ("inp", "u1"), ("outp", "u1"),
+    ("interval", "<u2"), ("offset", "<u2"),
+])
+module_dtypes = {1: module_dtype_v1, VERSION: module_dtype}
+# a module_dtype record, packed without numpy for speed
+record = struct.Struct("<HHBBI3BBBII")
+assert record.size == module_dtype.itemsize
+kinds = {name: i for i, name in enumerate(modules.names)}
+pulse_dtype = np.dtype([("x", "<u2"), ("y", "<u2"), ("dir", "u1")])
+
+
+def pack_module(mod: modules.Module) -> bytes:
+    r, g, b = mod.symbol[1]
+    return record.pack(mod.pos.x, mod.pos.y, kinds[mod.name.lower()], mod.active,
+                       ord(mod.symbol[0]), r, g, b,
+                       base.dir_mask(getattr(mod, "inp", ())), base.dir_mask(getattr(mod, "outp", ())),
+                       getattr(mod, "interval", 0), getattr(mod, "offset", 0))
+
+
+def pack_cells(mods: Dict[Tuple[int, int], modules.Module]) -> Dict[Tuple[int, int], bytes]:
+    # records of the modules of types in modules.names
+    return {key: pack_module(mod) for key, mod in mods.items()
+            if mod.name.lower() in kinds}
+
+
+def unpack_module(rec: np.void) -> modules.Module:
+    pos = base.Vec2d(int(rec["x"]), int(rec["y"]))
+    mod = modules.name_to_module(modules.names[rec["kind"]], pos)
+    color = tuple(int(c) for c in rec["color"])
+    mod.symbol = (chr(rec["char"]), color, mod.symbol[2])
+    if hasattr(mod, "inp"):
+        mod.inp = base.mask_dirs(rec["inp"])
+    if hasattr(mod, "outp"):
+        mod.outp = base.mask_dirs(rec["outp"])
+    if hasattr(mod, "interval"):
+        mod.interval = int(rec["interval"])
+        mod.offset = int(rec["offset"])
+    return mod
+
+
+def save(b: board.Board, path: str):
+    write(path, *take(b))
+
+
+def take(b: board.Board) -> Tuple[base.Vec2d, bytes, np.ndarray]:
+    # (dimensions, module records, pulse state) for write, quick enough to
+    # take while the board is locked
+    return b.dim, b"".join(pack_cells(b.modules).values()), b.get_pulse_state()
+
+
+def write(path: str, dim: base.Vec2d, recs: bytes, state: np.ndarray):
+    xs, ys, ds = base.key_parts(state, dim.y)
+    prec = np.zeros(len(state), dtype=pulse_dtype)
+    prec["x"], prec["y"], prec["dir"] = xs, ys, ds
+
+    # written next to the target first, so a crash never leaves half a file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header.pack(MAGIC, VERSION, dim.x, dim.y,
+                            len(recs)//module_dtype.itemsize, len(prec)))
+        f.write(recs)
+        f.write(prec.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read(path: str) -> Tuple[base.Vec2d, np.ndarray, np.ndarray]:
+    # (dimensions, module records, pulse records) of a board file
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, w, h, n_mods, n_pulses = header.unpack_from(data)
+    if magic != MAGIC or version not in module_dtypes:
+        raise ValueError("not a version %d board file: %s" % (VERSION, path))
+    rec_dtype = module_dtypes[version]
+    recs = np.frombuffer(data, rec_dtype, n_mods, header.size)
+    prec = np.frombuffer(data, pulse_dtype, n_pulses,
+                         header.size + n_mods*rec_dtype.itemsize)
+    if rec_dtype is not module_dtype:
+        recs = recs.astype(module_dtype)
+    return base.Vec2d(w, h), recs, prec
+
+
+def build(dim: base.Vec2d, recs: np.ndarray, prec: np.ndarray
+          ) -> Tuple[Dict[Tuple[int, int], modules.Module], Sequence[pulse.Pulse]]:
+    # modules and pulses for a board of dimensions dim, records outside
+    # of it are dropped
+    grid = {}
+    inside = (recs["x"] < dim.x) & (recs["y"] < dim.y)
+    for rec in recs[inside]:
+        mod = unpack_module(rec)
+        grid[(mod.pos.x, mod.pos.y)] = mod
+    inside = (prec["x"] < dim.x) & (prec["y"] < dim.y)
+    pulses = [pulse.Pulse(base.Vec2d(int(x), int(y)), base.DIRS[d])
+              for x, y, d in prec[inside].tolist()]
+    return grid, pulses
+
+
+def load(b: board.Board, path: str):
+    dim, recs, prec = read(path)
+    b.set_contents(*build(b.dim, recs, prec))
+
+
+def load_board(path: str, con_dim: base.Vec2d = None) -> board.Board:
+    # headless board of the file's size
+    dim, recs, prec = read(path)
+    con_dim = con_dim if con_dim else base.Vec2d(base.SCREEN_WIDTH, base.SCREEN_HEIGHT)
+    b = board.Board(tcod.console.Console(con_dim.x, con_dim.y, order="F"),
+                    0, con_dim, dim=dim)
+    b.set_contents(*build(dim, recs, prec))
+    return b
@@ -0,0 +1,115 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict, BinaryIO
+import argparse
+import heapq
+import struct
+import time
+import base
+import board
+import boardfile
+import cycle
+import midi
+
+# Offline rendering of a board into a Standard MIDI File (format 0).
+# One board beat is one quarter note at a tempo of base.STEP seconds per
+# beat, so the file plays back at the same speed as a live set.
+#   python bounce.py board.ilo out.mid --beats 18000
+
+PPQ = 96  # ticks per beat
+
+
+def varlen(n: int) -> bytes:  # midi variable length quantity
+    out = [n & 0x7F]
+    n >>= 7
+    while n:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    return bytes(reversed(out))
+
+
+class MidiFileWriter():  # streams a single track file to disk
+    f: BinaryIO
+    track_start: int  # file offset of the track length field
+    written_tick: int = 0  # time of the last event on disk
+    pending: list  # heap of (tick, seq, message), e.g. note-offs
+    seq: int = 0
+
+    def __init__(self, path: str, step: float = base.STEP):
+        self.f = open(path, "wb")
+        self.f.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, PPQ))
+        self.f.write(b"MTrk")
+        self.track_start = self.f.tell()
+        self.f.write(struct.pack(">I", 0))  # patched in close
+        tempo = int(step*1000000)
+        self.write(0, [0xFF, 0x51, 0x03, *tempo.to_bytes(3, "big")])
+        self.pending = []
+
+    def add(self, tick: int, message: Sequence[int]):
+        heapq.heappush(self.pending, (tick, self.seq, message))
+        self.seq += 1
+
+    def advance(self, tick: int):  # nothing earlier than tick will be added
+        while self.pending and self.pending[0][0] <= tick:
+            t, _, message = heapq.heappop(self.pending)
+            self.write(t, message)
+
+    def write(self, tick: int, message: Sequence[int]):
+        self.f.write(varlen(tick - self.written_tick) + bytes(message))
+        self.written_tick = tick
+
+    def close(self):
+        self.advance(float("inf"))
+        self.write(self.written_tick, [0xFF, 0x2F, 0x00])  # end of track
+        end = self.f.tell()
+        self.f.seek(self.track_start)
+        self.f.write(struct.pack(">I", end - self.track_start - 4))
+        self.f.close()
+
+
+def bounce(b: board.Board, beats: int, path: str, first_beat: int = 1,
+           step: float = base.STEP) -> Dict[str, float]:
+    # runs b for the given number of beats as fast as possible and writes
+    # every Output hit to path, memory stays constant over the length
+    live = midi.midi
+    midi.midi = midi.Midi(midi.NullMidiOut())  # only collects the batches
+    writer = MidiFileWriter(path, step)
+    notes = 0
+    cache = cycle.CycleCache()  # a settled board is replayed, not simulated
+    start = time.perf_counter()
+    try:
+        for beat in range(first_beat, first_beat + beats):
+            cache.update(b, beat)
+            tick = (beat - first_beat)*PPQ
+            for note, channel, duration, velocity in midi.midi.take_batch():
+                writer.add(tick, [0x90 + channel, note, velocity])
+                writer.add(tick + max(1, round(duration/step*PPQ)),
+                           [0x80 + channel, note, 0])
+                notes += 1
+            writer.advance(tick)
+    finally:
+        midi.midi = live
+        cache.reset(b)
+        writer.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "beats": beats,
+        "notes": notes,
+        "replayed": cache.replayed,
+        "seconds": elapsed,
+        "beats_per_second": beats/elapsed if elapsed else float("inf"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="render a board to a midi file")
+    parser.add_argument("board", help="board file saved with \".\"")
+    parser.add_argument("out", help="midi file to write")
+    parser.add_argument("--beats", type=int, default=1000)
+    args = parser.parse_args()
+    stats = bounce(boardfile.load_board(args.board), args.beats, args.out)
+    print("%(beats)d beats, %(notes)d notes in %(seconds).2f s "
+          "(%(beats_per_second).0f beats/s)" % stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict, Callable
+from collections import deque
+import threading
+import time
+import base
+
+
+def percentiles(samples: Sequence[float], qs: Sequence[float]) -> Sequence[float]:
+    if not samples:
+        return [0.0 for q in qs]
+    ordered = sorted(samples)
+    return [ordered[min(len(ordered)-1, int(q/100*len(ordered)))] for q in qs]
+
+
+class BeatClock():  # calls tick(beats) at absolute deadlines on its own thread
+    tick: Callable[[int], None]
+    step: float
+    beats: int = 0
+    missed: int = 0  # beats skipped because a tick overran a whole step
+    origin: float = 0.0  # perf_counter time of beat 0, as if it had run since
+    next_deadline: float = 0.0  # of the beat not yet ticked, in the past during a tick
+    jitter: deque  # seconds between each deadline and its tick
+    spin: float = 0.002  # busy wait this long before a deadline
+    thread: threading.Thread = None
+    stopped: threading.Event
+
+    def __init__(self, tick: Callable[[int], None], step: float = base.STEP,
+                 history: int = 1024):
+        self.tick = tick
+        self.step = step
+        self.jitter = deque(maxlen=history)
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        start = time.perf_counter()
+        self.origin = start - (self.beats + self.missed)*self.step
+        slot = 0
+        while not self.stopped.is_set():
+            slot += 1
+            # deadlines are absolute, so lateness never accumulates
+            deadline = start + slot*self.step
+            self.next_deadline = deadline
+            if not self.wait_until(deadline):
+                return
+            now = time.perf_counter()
+            self.jitter.append(now - deadline)
+            self.beats += 1
+            self.tick(self.beats)
+
+            behind = int((time.perf_counter() - start)/self.step) - slot
+            if behind > 0:
+                self.missed += behind
+                slot += behind
+
+    def wait_until(self, deadline: float) -> bool:
+        remaining = deadline - time.perf_counter() - self.spin
+        if remaining > 0 and self.stopped.wait(remaining):
+            return False
+        while time.perf_counter() < deadline:
+            time.sleep(0)
+        return True
+
+    def jitter_stats(self) -> Dict[str, float]:  # in milliseconds
+        samples = list(self.jitter)
+        p50, p95, p99 = percentiles(samples, (50, 95, 99))
+        return {
+            "mean": 1000*sum(samples)/len(samples) if samples else 0.0,
+            "p50": 1000*p50,
+            "p95": 1000*p95,
+            "p99": 1000*p99,
+            "max": 1000*max(samples) if samples else 0.0,
+            "missed": self.missed,
+        }
@@ -0,0 +1,193 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict, List
+from collections import deque
+import asyncio
+import json
+import socket
+import threading
+import time
+import tcod
+import base
+import modules
+import actions
+import clock
+import editor
+
+# Local control socket for scripts and controllers. One JSON object per
+# line, answered in order with one JSON line each:
+#   {"id": 1, "do": ["20l", "q", {"op": "type", "x": 3, "y": 4, "type": "emitter"},
+#                    {"op": "props", "x": 3, "y": 4, "props": {"interval": 2}}]}
+#   -> {"id": 1, "ok": true, "actions": 4, "ms": 0.4}
+#   {"id": 2, "stats": true} -> {"id": 2, "ok": true, "stats": {...}}
+# Strings are editor commands like at the prompt, an invalid one fails the
+# request; objects change a given cell. Property values are checked by the
+# module's schema, as text or as plain JSON values. A request is applied as
+# one Engine.do_actions, so it lands between two ticks and is one step in
+# the undo history. At most max_pending requests wait, after that the
+# server stops reading from the sockets until the engine caught up.
+
+
+class ControlServer():
+    eng: 'engine.Engine'
+    parser: editor.Editor  # reads the commands, without the prompt's state
+    max_pending: int
+    address: object = None  # socket path, or (host, port) once bound
+    latency: deque  # seconds from reading a request to its reply
+    requests: int = 0
+    errors: int = 0
+    max_queued: int = 0
+    ready: threading.Event
+    error: Exception = None  # why serve failed to start
+    thread: threading.Thread = None
+
+    def __init__(self, eng: 'engine.Engine', max_pending: int = 64, history: int = 1024):
+        self.eng = eng
+        con = tcod.console.Console(3, 3, order="F")
+        self.parser = editor.Editor(con, base.Vec2d(0, 0), base.Vec2d(3, 3))
+        self.max_pending = max_pending
+        self.latency = deque(maxlen=history)
+        self.ready = threading.Event()
+
+    def start(self, address: str):
+        # "host:port" for loopback tcp, anything else is a unix socket path
+        self.thread = threading.Thread(target=asyncio.run, args=(self.serve(address),),
+                                       daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+
+    async def serve(self, address: str):
+        self.queue = asyncio.Queue(self.max_pending)
+        try:
+            if ":" in address:
+                host, port = address.rsplit(":", 1)
+                server = await asyncio.start_server(self.handle, host, int(port))
+            else:
+                server = await asyncio.start_unix_server(self.handle, address)
+            self.address = server.sockets[0].getsockname()
+        except Exception as e:  # raised again by start
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+        async with server:
+            while True:
+                line, received, reply = await self.queue.get()
+                reply.set_result(self.apply(line, received))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # requests are read ahead of their replies, replies go out in order
+        replies = asyncio.Queue()
+        sender = asyncio.create_task(self.send_replies(replies, writer))
+        while line := await reader.readline():
+            reply = asyncio.get_running_loop().create_future()
+            await replies.put(reply)
+            await self.queue.put((line, time.perf_counter(), reply))
+            self.max_queued = max(self.max_queued, self.queue.qsize())
+        await replies.put(None)
+        await sender
+        writer.close()
+
+    async def send_replies(self, replies: asyncio.Queue, writer: asyncio.StreamWriter):
+        while (reply := await replies.get()) is not None:
+            writer.write(json.dumps(await reply).encode() + b"\n")
+            await writer.drain()
+
+    def apply(self, line: bytes, received: float) -> Dict:
+        self.requests += 1
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if request.get("stats"):
+                return {"id": request_id, "ok": True, "stats": self.stats()}
+            todo = []
+            types = {}  # cell -> module class, as set earlier in the request
+            for item in request.get("do", ()):
+                if isinstance(item, str):
+                    todo += self.command(item)
+                else:
+                    todo.append(self.cell_action(item, types))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.errors += 1
+            return {"id": request_id, "ok": False, "error": "%s: %s" % (type(e).__name__, e)}
+        if todo:
+            self.eng.do_actions(todo)
+            self.eng.last_input = time.perf_counter()
+        latency = time.perf_counter() - received
+        self.latency.append(latency)
+        return {"id": request_id, "ok": True, "actions": len(todo), "ms": 1000*latency}
+
+    def command(self, cmd: str) -> Sequence[actions.Action]:
+        # property keys are those of the module under the cursor
+        self.parser.update_keymap(self.eng.board.module_at(*self.eng.editor.cursor.to_tuple()))
+        self.parser.focused_property = None
+        todo = self.parser.exec_command(cmd) if cmd else None
+        if todo is None:  # a property key alone would wait for its value
+            raise ValueError("invalid command " + repr(cmd))
+        return todo
+
+    def cell_action(self, op: Dict, types: Dict[Tuple[int, int], type]) -> actions.Action:
+        pos = base.Vec2d(int(op["x"]), int(op["y"]))
+        dim = self.eng.board.dim
+        if not (0 <= pos.x < dim.x and 0 <= pos.y < dim.y):
+            raise ValueError("%d, %d is outside the board" % (pos.x, pos.y))
+        if op["op"] == "type":
+            if op["type"].strip().lower() not in modules.names:
+                raise ValueError("no module type " + op["type"])
+            types[pos.to_tuple()] = type(modules.name_to_module(op["type"], pos))
+            return actions.atCell(pos, actions.changeType(op["type"]))
+        if op["op"] == "props":
+            cls = types.get(pos.to_tuple()) or type(self.eng.board.module_at(pos.x, pos.y))
+            changes = {}
+            for name, value in op["props"].items():
+                if name not in cls.schema:
+                    raise ValueError("%s has no property %s" % (cls.name, name))
+                prop = cls.schema[name]
+                # plain JSON values go through the same check as text
+                if not isinstance(value, str):
+                    value = prop.type.format(tuple(value) if isinstance(value, list) else value)
+                changes[name] = prop.type.parse(value)
+            return actions.atCell(pos, actions.changeProperty(changes))
+        raise ValueError("unknown op " + str(op["op"]))
+
+    def stats(self) -> Dict[str, float]:  # latencies in milliseconds
+        samples = list(self.latency)
+        p50, p95, p99 = clock.percentiles(samples, (50, 95, 99))
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "max_queued": self.max_queued,
+            "p50": 1000*p50,
+            "p95": 1000*p95,
+            "p99": 1000*p99,
+            "max": 1000*max(samples) if samples else 0.0,
+        }
+
+
+def connect(address) -> socket.socket:  # for scripts, the address as printed by main.py
+    if isinstance(address, str) and ":" not in address:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    else:
+        if isinstance(address, str):
+            host, port = address.rsplit(":", 1)
+            address = (host, int(port))
+        sock = socket.create_connection(address)
+    return sock
+
+
+def send(sock: socket.socket, requests: Sequence[Dict]) -> List[Dict]:
+    # writes all requests, then reads one reply each
+    sock.sendall(b"".join(json.dumps(r).encode() + b"\n" for r in requests))
+    replies = []
+    buffered = b""
+    while len(replies) < len(requests):
+        data = sock.recv(65536)
+        if not data:
+            break
+        buffered += data
+        *lines, buffered = buffered.split(b"\n")
+        replies += [json.loads(line) for line in lines]
+    return replies
@@ -0,0 +1,110 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict
+import math
+import sys
+import numpy as np
+import board
+import modules
+import midi
+
+# A board of only the built in modules is deterministic: the pulses after a
+# beat and the emitter phase (beats modulo the lcm of the intervals) decide
+# everything that follows. Once such a state comes round again the board is
+# in a loop, and the recorded beats of the loop are replayed instead of
+# simulated until the next edit.
+
+known = (modules.Empty, modules.Emitter, modules.Spreader, modules.Output)
+
+
+class CycleCache():
+    max_bytes: int = 64000000  # of recorded beats, then it pauses
+    phase_len: int = None  # lcm of the emitter intervals, 0 if not cacheable
+    # per recorded beat: (pulse state, position snapshot, pulse count, notes)
+    history: list
+    seen: Dict[Tuple[int, bytes], int]  # (phase, state) -> history index
+    recorded_bytes: int = 0
+    resume_beat: int = 0  # recording pauses after running out of bytes
+    first_beat: int = 0  # beat of history[0]
+    last_beat: int = None
+    start: int = 0  # history index the loop begins at
+    period: int = 0  # beats, 0 until a loop was found
+    current: int = 0  # history index of the last replayed beat
+    stale: bool = False  # the board's own pulses lag behind the replay
+    replayed: int = 0  # beats not simulated
+
+    def __init__(self):
+        self.history = []
+        self.seen = {}
+
+    def update(self, b: board.Board, beats: int):  # instead of b.update
+        if self.last_beat is not None and beats != self.last_beat + 1:
+            self.reset(b)  # skipped beats break the recorded sequence
+        self.last_beat = beats
+        if self.period:
+            i = self.start + (beats - self.first_beat - self.start) % self.period
+            state, snapshot, count, notes = self.history[i]
+            for (channel, note), (velocity, duration) in notes:
+                midi.midi.queue_note(note, channel, duration, velocity)
+            b.pulse_snapshot = snapshot
+            b.pulse_count = count
+            self.current = i
+            self.stale = True
+            self.replayed += 1
+            return
+        b.update(beats)
+        self.record(b, beats)
+
+    def record(self, b: board.Board, beats: int):
+        if self.phase_len is None:
+            self.phase_len = self.cycle_length(b)
+        if not self.phase_len or beats < self.resume_beat:
+            return
+        if not self.history:
+            self.first_beat = beats
+        state = b.get_pulse_state().tobytes()
+        notes = [(key, tuple(hit)) for key, hit in midi.midi.batch.items()]
+        self.history.append((state, b.pulse_snapshot, b.pulse_count, notes))
+        n = len(self.history) - 1
+        key = (beats % self.phase_len, state)
+        if key in self.seen:
+            self.start = self.seen[key] + 1
+            self.period = n - self.seen[key]
+            self.seen = {}
+            return
+        self.seen[key] = n
+        self.recorded_bytes += self.entry_bytes(b, state, notes)
+        if self.recorded_bytes > self.max_bytes:
+            # no loop in sight, pause for as long as it was recorded and
+            # then try again, the board may still settle
+            self.resume_beat = beats + len(self.history)
+            self.history = []
+            self.seen = {}
+            self.recorded_bytes = 0
+
+    def entry_bytes(self, b: board.Board, state: bytes, notes: list) -> int:
+        # mostly the snapshot's position pairs, their coordinates are
+        # objects of their own past the small int cache
+        pair = sys.getsizeof((0, 0)) + sys.getsizeof(1000)*sum(
+            max(0, n - 257)/n for n in (b.dim.x, b.dim.y))
+        return int(sys.getsizeof(state) + sys.getsizeof(b.pulse_snapshot) +
+                   len(b.pulse_snapshot)*pair + sys.getsizeof(notes) +
+                   len(notes)*3*sys.getsizeof((0, 0)))
+
+    def cycle_length(self, b: board.Board) -> int:
+        if any(type(mod) not in known for mod in b.modules.values()):
+            return 0
+        return math.lcm(*(max(1, b.modules[pos].interval)
+                          for pos in b.active_modules))
+
+    def reset(self, b: board.Board):  # before anything edits b
+        if self.stale:
+            b.set_pulse_state(np.frombuffer(self.history[self.current][0],
+                                            dtype=np.int64))
+            self.stale = False
+        self.phase_len = None
+        self.history = []
+        self.seen = {}
+        self.recorded_bytes = 0
+        self.resume_beat = 0
+        self.last_beat = None
+        self.period = 0
@@ -5,7 +5,14 @@ import abc
 import base
 import modules
 import actions
+import props
 
+pan_keys = {  # with shift held
+    tcod.event.K_UP: base.DIR_UP,
+    tcod.event.K_DOWN: base.DIR_DOWN,
+    tcod.event.K_LEFT: base.DIR_LEFT,
+    tcod.event.K_RIGHT: base.DIR_RIGHT,
+}
 
 class Editor():  # input handler and menu
     con: 'Console' = None
@@ -18,8 +25,10 @@ class Editor():  # input handler and menu
     topmenu_text: Sequence[Sequence[str]] = [
         ["system commands (instant)",
          "esc - exit ilokalama",
-         ". - save board (TODO)",
-         ", - load board (TODO)"],
+         ". - save board to "+base.board_path,
+         ", - load board from "+base.board_path,
+         "shift+arrows - pan the view",
+         "f2 - toggle the minimap"],
         ["generic commands",
          "[number]* - repeat commands n times"],
         ["module commands"]+[
@@ -27,13 +36,16 @@ class Editor():  # input handler and menu
             for i, name in enumerate(modules.names)
         ],
         #  base.mod_type_keys[3]+" - change module type to output"],
-        []
+        [],
+        ["history",
+         "u - undo, [number]u - undo n steps",
+         "ctrl+r - redo"]
     ]
     submenu_text: Sequence[Sequence[str]] = [
         ["system commands (instant)",
          "esc - exit submenu",
-         ". - save board (TODO)",
-         ", - load board (TODO)"],
+         ". - save board to "+base.board_path,
+         ", - load board from "+base.board_path],
         []
     ]
     commandline: str = ""
@@ -47,10 +59,13 @@ class Editor():  # input handler and menu
         "h": actions.moveCursor(base.DIR_LEFT),
         "j": actions.moveCursor(base.DIR_DOWN),
         "k": actions.moveCursor(base.DIR_UP),
-        "l": actions.moveCursor(base.DIR_RIGHT)
+        "l": actions.moveCursor(base.DIR_RIGHT),
+        "u": actions.undoEdit()
     }
-    mod_keytable = {}
-    focused_property: str = None
+    mod_keytable: Dict[str, props.Prop] = {}
+    keymap_type: type = None  # module class the keytable was built for
+    module: modules.Module = None  # under the cursor
+    focused_property: props.Prop = None
 
     def __init__(self, con: tcod.console.Console, con_pos: base.Vec2d, con_dim: base.Vec2d):
         self.con = con
@@ -58,6 +73,9 @@ class Editor():  # input handler and menu
         self.con.default_fg = base.cols["fg"]
         self.con_dim = con_dim
         self.con_pos = con_pos
+        # the keymap rewrites parts of the menus, per editor
+        self.topmenu_text = [list(block) for block in self.topmenu_text]
+        self.submenu_text = [list(block) for block in self.submenu_text]
 
     def render(self):
         def bar(ch):
@@ -105,7 +123,15 @@ class Editor():  # input handler and menu
                 raise SystemExit()
             else:
                 self.focused_property = None
-        if event.sym == tcod.event.K_DOWN:
+        if event.sym == tcod.event.K_PERIOD:
+            return [actions.saveBoard(base.board_path)]
+        elif event.sym == tcod.event.K_COMMA:
+            return [actions.loadBoard(base.board_path)]
+        elif event.sym == tcod.event.K_r and event.mod & tcod.event.KMOD_CTRL:
+            return [actions.redoEdit()]
+        elif event.sym in pan_keys and event.mod & tcod.event.KMOD_SHIFT:
+            return [actions.panView(pan_keys[event.sym])]
+        elif event.sym == tcod.event.K_DOWN:
             self.focused_property = None
             return [actions.moveCursor(base.DIR_DOWN)]
         elif event.sym == tcod.event.K_UP:
@@ -132,69 +158,73 @@ class Editor():  # input handler and menu
                 return None
         return None
 
-    def update_keymap(self, mod_props, mod_name: str):
-        if mod_props and not self.focused_property:
-            self.mod_keytable = {}
-            menu_entry = ["property commands: "+mod_name]
-            for i, d in enumerate(mod_props.items()):
-                name, prop = d
-                key = base.mod_prop_keys[i]
-                self.mod_keytable[key] = (name, prop)
-                menu_entry.append(key+" - "+prop[2])
-        elif not mod_props:
-            menu_entry = []
-        else:
-            self.focused_property = None
+    def update_keymap(self, mod: modules.Module):
+        # the menu only lists the properties, so it only changes with the type
+        self.module = mod
+        if type(mod) is self.keymap_type:
             return
-        self.topmenu_text[3] = menu_entry
+        self.keymap_type = type(mod)
+        self.focused_property = None
+        self.mod_keytable = {base.mod_prop_keys[i]: prop
+                             for i, prop in enumerate(mod.schema.values())}
+        if self.mod_keytable:
+            self.topmenu_text[3] = ["property commands: "+mod.name] + [
+                key+" - "+prop.description for key, prop in self.mod_keytable.items()]
+        else:
+            self.topmenu_text[3] = []
+
+    def set_history_stats(self, stats: Dict[str, int]):
+        self.topmenu_text[4] = self.topmenu_text[4][:3] + [
+            "%d steps to undo, %d to redo" % (stats["undo"], stats["redo"]),
+            "%d snapshots, %.1f kB" % (stats["snapshots"], stats["bytes"]/1000)]
 
     def exec_command(self, cmd: str) -> Sequence[actions.Action]:
         if self.focused_property:
-            changes = {
-                self.focused_property[0]: (cmd, *self.focused_property[1][1:])
-            }
+            prop = self.focused_property
             self.focused_property = None
-            return [actions.changeProperty(changes)]
+            return self.change_property(prop, cmd)
         elif cmd[0] in self.mod_keytable:
-            self.focused_property = self.mod_keytable[cmd[0]]
+            prop = self.mod_keytable[cmd[0]]
             if len(cmd) == 1:
+                self.focused_property = prop
                 self.submenu_text[1] = [
-                    self.mod_keytable[cmd][1][2],
-                    "type: "+self.mod_keytable[cmd][1][1],
-                    "current value: "+self.mod_keytable[cmd][1][0]
+                    prop.description,
+                    "type: "+prop.type.name,
+                    "current value: "+prop.type.format(prop.get(self.module))
                 ]
                 return None
             else:
-                changes = {
-                    self.focused_property[0]: (
-                        cmd[1:], *self.focused_property[1][1:])
-                }
-                self.focused_property = None
-                return [actions.changeProperty(changes)]
+                return self.change_property(prop, cmd[1:])
 
-        multiplier = 1
+        # [number] repeats the commands up to the next number, each block
+        # becomes one run-length action instead of count copies
         ret_actions = []
         staged_actions = []
-        block = True
+        multiplier = None
         for c in cmd:
             if c.isnumeric():
-                if block:
-                    ret_actions += staged_actions * multiplier
-                    multiplier = int(c)
+                if staged_actions:
+                    ret_actions += actions.repeat(staged_actions, multiplier)
                     staged_actions = []
-                    block = False
-                else:
-                    multiplier = multiplier*10 + int(c)
+                    multiplier = None
+                multiplier = (multiplier or 0)*10 + int(c)
+            elif c in self.keytable:
+                staged_actions.append(self.keytable[c])
             else:
-                if c in self.keytable:
-                    action = self.keytable[c]
-                    staged_actions.append(action)
-                else:
-                    print("invalid char:", c)
-                    return None
-        ret_actions += staged_actions * multiplier
+                print("invalid char:", c)
+                return None
+        ret_actions += actions.repeat(staged_actions, multiplier)
         return ret_actions
 
+    def change_property(self, prop: props.Prop, text: str) -> Sequence[actions.Action]:
+        # the only place property values are parsed from text
+        try:
+            value = prop.type.parse(text)
+        except ValueError as e:
+            print("invalid", prop.type.name, "for", prop.name+":", text, e)
+            return None
+        return [actions.changeProperty({prop.name: value})]
+
     def set_focused_property(self, char):
         pass
 
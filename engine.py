@@ -1,6 +1,8 @@
 from __future__ import annotations
 from typing import Tuple, Sequence, Dict, Set
 import abc
+import threading
+import time
 import tcod
 import base
 import modules
@@ -8,6 +10,12 @@ import pulse
 import actions
 import editor
 import board
+import clock
+import cycle
+import journal
+import lookahead
+import midi
+import profiler
 
 # TODO
 # 1. Menü States - Oder vielleicht auch nicht
@@ -25,10 +33,18 @@ class Engine():
     bcon_offset: int = 3  # should be multiple of three
     econ_offset: int = 3  # should be multiple of three
     e_ratio: int = 3  # size of fraction of screen of edit_con
-    # positions of active modules on board:
-    delta: float = 0
     beats: int = 0
-    actions: Sequence[Sequence[actions.Action]] = []
+    journal: journal.Journal  # undo history of the modules
+    clock: clock.BeatClock
+    lock: threading.Lock  # held while the board is ticked or edited
+    cycle: cycle.CycleCache  # replays the board once it loops
+    lookahead: lookahead.Lookahead  # simulates ahead of the clock
+    # frames are only drawn when something changed, see wait
+    version: int = 0  # counts changes to what is on screen
+    drawn_version: int = -1
+    last_render: float = 0.0
+    last_input: float = 0.0
+    active_time: float = 2.0  # seconds after a key that frames run at LIMIT_FPS
 
     def __init__(self):
         self.e_ratio = base.SCREEN_WIDTH//self.e_ratio - \
@@ -38,50 +54,188 @@ class Engine():
         bcon_dim = base.Vec2d(base.SCREEN_WIDTH-self.e_ratio - self.bcon_offset*2,
                               base.SCREEN_HEIGHT - self.bcon_offset*2)
         board_con = tcod.console.Console(bcon_dim.x,
-                                         bcon_dim.y)
+                                         bcon_dim.y, order="F")
         editor_con = tcod.console.Console(econ_dim.x,
                                           econ_dim.y)
-        self.board = board.Board(board_con, self.e_ratio, bcon_dim)
+        self.board = board.Board(board_con, self.e_ratio, bcon_dim,
+                                 dim=base.BOARD_SIZE)
         self.editor = editor.Editor(editor_con, 0, econ_dim)
-        self.editor.update_keymap(self.board.get_prop_at(self.editor.cursor),
-                                  self.board.get_name_at(self.editor.cursor))
+        self.editor.update_keymap(self.board.module_at(*self.editor.cursor.to_tuple()))
+        self.lock = threading.Lock()
+        self.cycle = cycle.CycleCache()
+        self.journal = journal.Journal()
+        self.clock = clock.BeatClock(self.tick)
+        self.lookahead = lookahead.Lookahead(self.clock)
 
-    def update(self) -> bool:
+    def start(self):
+        self.clock.start()
+
+    def tick(self, beats: int):  # called by the clock thread
+        start = time.perf_counter()
+        with self.lock:
+            self.beats = beats
+            # moving pulses
+            snapshot = self.board.pulse_snapshot
+            if self.lookahead.beats:
+                self.lookahead.tick(self.board, self.cycle, self.beats)
+            else:
+                self.cycle.update(self.board, self.beats)
+                midi.midi.flush()
+            if self.board.pulse_snapshot != snapshot:
+                self.version += 1
+        profiler.prof.record("tick", time.perf_counter() - start)
+        if self.clock.jitter:  # of this beat, the overlay shows it apart
+            profiler.prof.record("jitter", self.clock.jitter[-1], overlay=False)
+
+    def wait(self) -> Sequence[tcod.event.Event]:
+        # sleeps until input, the next beat or the next frame that is due
+        now = time.perf_counter()
+        wake = min(self.next_frame(), self.clock.next_deadline)
+        if self.clock.next_deadline <= now:
+            wake = max(wake, now + 0.001)  # the beat is being ticked
+        if now - self.last_input < self.active_time:
+            # edits can also come from the control thread
+            wake = min(wake, now + 1/base.LIMIT_FPS)
+        return list(tcod.event.wait(max(0.0, wake - now)))
+
+    def next_frame(self) -> float:
+        if self.version == self.drawn_version and not profiler.prof.overlay:
+            return self.last_render + base.STATUS_INTERVAL
+        active = time.perf_counter() - self.last_input < self.active_time
+        return self.last_render + 1/(base.LIMIT_FPS if active else base.IDLE_FPS)
+
+    def frame_due(self) -> bool:
+        return time.perf_counter() >= self.next_frame()
+
+    def update(self, events: Sequence[tcod.event.Event]):
         # key handling
-        for event in tcod.event.get():
+        for event in events:
             if event.type == "QUIT":
                 raise SystemExit()
-            if event.type == "KEYUP":
+            if isinstance(event, tcod.event.MouseMotion):
+                continue
+            self.version += 1
+            if isinstance(event, tcod.event.WindowEvent):
+                self.board.invalidate()  # resized or exposed
+            if isinstance(event, tcod.event.KeyboardEvent):
+                self.last_input = time.perf_counter()
+            if event.type == "KEYUP" and event.sym == tcod.event.K_F3:
+                profiler.prof.overlay = not profiler.prof.overlay
+            elif event.type == "KEYUP" and event.sym == tcod.event.K_F2:
+                self.board.show_minimap = not self.board.show_minimap
+            elif event.type == "KEYUP":
                 actions = self.editor.handle_input(event, self.board.dim)
                 if actions:
                     self.do_actions(actions)
 
-        self.delta += tcod.sys_get_last_frame_length()
-        if self.delta >= base.STEP:
-            self.beats += 1
-            # moving pulses
-            self.board.update(self.beats)
-            self.delta = 0
-
     def render(self):
-        self.board.render(self.editor.cursor)
+        self.drawn_version = self.version
+        self.last_render = time.perf_counter()
+        with self.lock:  # the control thread edits cells too
+            changes = self.board.take_changes()
+        self.board.render(self.editor.cursor, changes)
+        profiler.prof.mark("board")
         self.editor.render()
-        base.root_console.print(5, 0, "fps: "+str(tcod.sys_get_fps()))
+        profiler.prof.mark("editor")
+        jitter = self.clock.jitter_stats()
+        base.root_console.print(5, 0, "fps: "+str(tcod.sys_get_fps()) +
+                                "  beat jitter p50/p95/max: %.1f/%.1f/%.1f ms"
+                                % (jitter["p50"], jitter["p95"], jitter["max"]) +
+                                "  midi dropped: %d, cancels dropped: %d"
+                                % (midi.midi.scheduler.dropped,
+                                   midi.midi.scheduler.dropped_cancels))
+        profiler.prof.render(self.board.pulse_count, jitter)
+        profiler.prof.mark("overlay")
 
     def do_actions(self, actions: Sequence[actions.Action]):
-        staged_actions = []
         for action in actions:
-            if action.scope == "Module":
-                staged_actions.append(self.board.do_action(action,
-                                                           self.editor.cursor))
-            elif action.scope == "Editor":
-                self.editor = action.do(self.editor, self.board.dim)
-                staged_actions.append(action)
-            else:
-                print("invalid action scope", action.scope)
-        self.editor.update_keymap(self.board.get_prop_at(self.editor.cursor),
-                                  self.board.get_name_at(self.editor.cursor))
-        self.actions.append(staged_actions)
+            if action.scope == "Board":
+                action.prepare(self.board)
+        with self.lock:
+            self.apply_actions(actions)
+        for action in actions:
+            if action.scope == "Board":
+                action.finish(self.board)
+        self.version += 1
+
+    def apply_actions(self, actions: Sequence[actions.Action]):
+        # notes scheduled ahead only go when the board changes
+        if any(action.edits for action in actions):
+            self.lookahead.rewind(self.board, self.cycle)
+        elif any(action.scope == "Board" for action in actions):
+            self.cycle.reset(self.board)  # a replay leaves the pulses behind, for saving
+        cursor = self.editor.cursor.to_tuple()
+        changes = {}  # cell -> [packed before, packed after], for the journal
+        for action in actions:
+            changes = self.apply_action(action, changes)
+        self.record_changes(changes)
+        if self.editor.cursor.to_tuple() != cursor:
+            self.board.follow(self.editor.cursor)
+        self.editor.update_keymap(self.board.module_at(*self.editor.cursor.to_tuple()))
+
+    def apply_action(self, action: actions.Action, changes: Dict) -> Dict:
+        if action.scope == "Module":
+            self.apply_module(action, self.editor.cursor, changes)
+        elif action.scope == "Cell":
+            self.apply_module(action.action, action.pos, changes)
+        elif action.scope == "Editor":
+            self.editor = action.do(self.editor, self.board.dim)
+        elif action.scope == "Board":
+            before = journal.pack_board(self.board) if action.journaled else None
+            self.board = action.do(self.board)
+            if action.journaled:
+                # packed by prepare, outside the lock
+                after = before if action.cells is None else action.cells
+                for key in before.keys() | after.keys():
+                    cell = changes.setdefault(key, [before.get(key, b""), None])
+                    cell[1] = after.get(key, b"")
+        elif action.scope == "Journal":
+            self.record_changes(changes)  # what came before in the command
+            changes = {}
+            self.journal = action.do(self.journal, self.board)
+        elif action.scope == "Repeat":
+            changes = self.apply_repeat(action, changes)
+        else:
+            print("invalid action scope", action.scope)
+        return changes
+
+    def apply_module(self, action: actions.Action, pos: base.Vec2d, changes: Dict):
+        key = pos.to_tuple()
+        cell = changes.setdefault(
+            key, [journal.pack(self.board.module_at(*key)), None])
+        self.board.do_action(action, pos)
+        cell[1] = journal.pack(self.board.module_at(*key))
+
+    def apply_repeat(self, repeat: actions.repeatActions, changes: Dict) -> Dict:
+        block = repeat.actions
+        if all(isinstance(action, actions.moveCursor) for action in block):
+            # one clamped move per axis, raised to the count
+            dim = self.board.dim
+            fx, fy = (0, 0, dim.x - 1), (0, 0, dim.y - 1)
+            for action in block:
+                fx = actions.compose(fx, actions.clamped_move(action.direction.x, dim.x))
+                fy = actions.compose(fy, actions.clamped_move(action.direction.y, dim.y))
+            fx, fy = actions.power(fx, repeat.count), actions.power(fy, repeat.count)
+            cursor = self.editor.cursor
+            self.editor.cursor = base.Vec2d(actions.apply_move(fx, cursor.x),
+                                            actions.apply_move(fy, cursor.y))
+            return changes
+        idempotent = all(action.idempotent or action.scope == "Editor"
+                         for action in block)
+        for i in range(repeat.count):
+            start = self.editor.cursor.to_tuple()
+            for action in block:
+                changes = self.apply_action(action, changes)
+            # back where it started with nothing that adds up, so every
+            # further round would change nothing
+            if idempotent and self.editor.cursor.to_tuple() == start:
+                break
+        return changes
+
+    def record_changes(self, changes: Dict[Tuple[int, int], list]):
+        self.journal.record(self.board, [(key, before, after) for key, (before, after)
+                                         in changes.items() if before != after])
+        self.editor.set_history_stats(self.journal.stats())
 
 
 eng = Engine()
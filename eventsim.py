@@ -0,0 +1,221 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict, List, FrozenSet
+from bisect import bisect_left, bisect_right, insort
+import heapq
+import itertools
+import numpy as np
+import base
+import pulse
+import midi
+
+# Pulses only change course where a module acts on them (the cells with a
+# Board.transfer entry), everywhere else they move one cell per step. So
+# instead of stepping every pulse, each one is a flight from where it was
+# launched, with the step it next reaches an acting cell or the board edge
+# queued. A tick only handles the flights that arrive.
+
+# direction codes, see base.dir_code
+DX = base.DX
+DY = base.DY
+DX_ARRAY = np.array(DX, dtype=np.int64)
+DY_ARRAY = np.array(DY, dtype=np.int64)
+
+
+class EventSim():  # event driven backend for Board.update
+    board: 'board.Board'
+    # sorted indexes of the acting cells, per row and per column
+    rows: Dict[int, List[int]]  # y -> xs
+    cols: Dict[int, List[int]]  # x -> ys
+    # flights are keyed by their line of travel and their offset on it, so
+    # two pulses that would move together share a key
+    flights: Dict[Tuple[int, int, int], Tuple[int, int]]  # -> (slot, arrival)
+    queue: list  # heap of (arrival, slot, key), stale entries are skipped
+    # per slot: position and direction code at the launch step
+    x0: np.ndarray
+    y0: np.ndarray
+    d0: np.ndarray
+    t0: np.ndarray
+    alive: np.ndarray
+    free: List[int]
+    # pulses launched onto an existing flight by an emitter or set_pulses,
+    # only for the step they appear in, like the duplicates on a pulse list
+    extra: List[Tuple[int, int, int]]
+    now: int = 0  # steps, one per update
+    stale_queue: bool = False  # acting cells changed since the last update
+
+    def __init__(self, board: 'board.Board'):
+        self.board = board
+        self.rows = {}
+        self.cols = {}
+        for x, y in board.transfer:
+            insort(self.rows.setdefault(y, []), x)
+            insort(self.cols.setdefault(x, []), y)
+        self.set_pulses(board.pulses)
+
+    def key(self, x: int, y: int, c: int, t: int) -> Tuple[int, int, int]:
+        if DX[c]:
+            return (c, y, x - DX[c]*t)
+        return (c, x, y - DY[c]*t)
+
+    def arrival(self, x: int, y: int, c: int, t: int) -> int:
+        # step that handles the pulse at (x, y) at step t, either in the
+        # next acting cell on its way (this one included) or by moving it
+        # off the board
+        dim = self.board.dim
+        if c == 3:
+            row = self.rows.get(y, ())
+            i = bisect_left(row, x)
+            k = row[i] - x if i < len(row) else dim.x - 1 - x
+        elif c == 2:
+            row = self.rows.get(y, ())
+            i = bisect_right(row, x)
+            k = x - row[i - 1] if i else x
+        elif c == 1:
+            col = self.cols.get(x, ())
+            i = bisect_left(col, y)
+            k = col[i] - y if i < len(col) else dim.y - 1 - y
+        else:
+            col = self.cols.get(x, ())
+            i = bisect_right(col, y)
+            k = y - col[i - 1] if i else y
+        return t + 1 + k
+
+    def launch(self, x: int, y: int, c: int, merge: bool):
+        # merge drops the pulse if a flight is already there, otherwise it
+        # is kept as an extra for this step
+        key = self.key(x, y, c, self.now)
+        if key in self.flights:
+            if not merge:
+                self.extra.append((x, y, c))
+            return
+        if not self.free:
+            self.grow()
+        slot = self.free.pop()
+        self.x0[slot], self.y0[slot], self.d0[slot] = x, y, c
+        self.t0[slot] = self.now
+        self.alive[slot] = True
+        arrival = self.arrival(x, y, c, self.now)
+        self.flights[key] = (slot, arrival)
+        heapq.heappush(self.queue, (arrival, slot, key))
+
+    def grow(self):
+        n = len(self.alive)
+        size = max(64, 2*n)
+        self.x0 = np.resize(self.x0, size)
+        self.y0 = np.resize(self.y0, size)
+        self.d0 = np.resize(self.d0, size)
+        self.t0 = np.resize(self.t0, size)
+        self.alive = np.resize(self.alive, size)
+        self.alive[n:] = False
+        self.free = list(range(size - 1, n - 1, -1))
+
+    def on_cell_changed(self, pos: base.Vec2d):
+        acting = (pos.x, pos.y) in self.board.transfer
+        row = self.rows.setdefault(pos.y, [])
+        col = self.cols.setdefault(pos.x, [])
+        i = bisect_left(row, pos.x)
+        present = i < len(row) and row[i] == pos.x
+        if acting and not present:
+            row.insert(i, pos.x)
+            insort(col, pos.y)
+        elif present and not acting:
+            del row[i]
+            col.remove(pos.y)
+        else:
+            return
+        self.stale_queue = True
+
+    def reschedule(self):
+        # arrivals after an edit, every flight starts over from where it is
+        self.queue = []
+        for key, (slot, arrival) in self.flights.items():
+            x, y, c = self.position(slot)
+            self.x0[slot], self.y0[slot], self.t0[slot] = x, y, self.now
+            arrival = self.arrival(x, y, c, self.now)
+            self.flights[key] = (slot, arrival)
+            self.queue.append((arrival, slot, key))
+        heapq.heapify(self.queue)
+        self.stale_queue = False
+
+    def position(self, slot: int, t: int = None) -> Tuple[int, int, int]:
+        t = self.now if t is None else t
+        c = int(self.d0[slot])
+        dt = t - int(self.t0[slot])
+        return int(self.x0[slot]) + DX[c]*dt, int(self.y0[slot]) + DY[c]*dt, c
+
+    def set_pulses(self, pulses: Sequence[pulse.Pulse]):
+        self.flights = {}
+        self.queue = []
+        self.extra = []
+        self.x0 = np.zeros(0, dtype=np.int32)
+        self.y0 = np.zeros(0, dtype=np.int32)
+        self.d0 = np.zeros(0, dtype=np.int8)
+        self.t0 = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.free = []
+        for p in pulses:
+            self.launch(p.pos.x, p.pos.y, base.dir_code(p.direction), merge=False)
+        self.stale_queue = False
+
+    def positions(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        slots = np.flatnonzero(self.alive)
+        ds = self.d0[slots]
+        dt = self.now - self.t0[slots]
+        xs = self.x0[slots] + DX_ARRAY[ds]*dt
+        ys = self.y0[slots] + DY_ARRAY[ds]*dt
+        return xs, ys, ds
+
+    def get_pulses(self) -> Sequence[pulse.Pulse]:
+        xs, ys, ds = self.positions()
+        return [pulse.Pulse(base.Vec2d(x, y), base.DIRS[c]) for x, y, c
+                in list(zip(xs.tolist(), ys.tolist(), ds.tolist())) + self.extra]
+
+    def get_pulse_positions(self) -> FrozenSet[Tuple[int, int]]:
+        xs, ys, ds = self.positions()
+        return frozenset(itertools.chain(zip(xs.tolist(), ys.tolist()),
+                                         ((x, y) for x, y, c in self.extra)))
+
+    def count(self) -> int:
+        return len(self.flights) + len(self.extra)
+
+    def update(self, beats: int):
+        if self.stale_queue:
+            self.reschedule()
+        self.now += 1
+        t = self.now
+        # where the arriving pulses were before this step
+        arrived = self.extra
+        self.extra = []
+        queue = self.queue
+        while queue and queue[0][0] <= t:
+            arrival, slot, key = heapq.heappop(queue)
+            if self.flights.get(key) != (slot, arrival):
+                continue
+            del self.flights[key]
+            self.alive[slot] = False
+            self.free.append(slot)
+            arrived.append(self.position(slot, t - 1))
+
+        transfer = self.board.transfer
+        dim = self.board.dim
+        for x, y, c in arrived:
+            if (x, y) not in transfer:
+                continue  # moves off the board, or merges into its twin
+            table = transfer[(x, y)]
+            if table is None:
+                p = pulse.Pulse(base.Vec2d(x, y), base.DIRS[c])
+                outs = [(q.pos.x, q.pos.y, base.dir_code(q.direction))
+                        for q in self.board.modules[(x, y)].on_pulse(p)]
+            else:
+                directions, note = table[base.dir_slot(base.DIRS[c])]
+                if note:
+                    midi.midi.queue_note(*note)
+                outs = [(x + o.x, y + o.y, base.dir_code(o)) for o in directions]
+            for nx, ny, nc in outs:
+                if 0 <= nx < dim.x and 0 <= ny < dim.y:
+                    self.launch(nx, ny, nc, merge=True)
+
+        # sources
+        for x, y in self.board.active_modules:
+            for p in self.board.modules[(x, y)].on_beat(beats):
+                self.launch(p.pos.x, p.pos.y, base.dir_code(p.direction), merge=False)
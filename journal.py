@@ -0,0 +1,146 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict
+from collections import deque
+import sys
+import numpy as np
+import base
+import boardfile
+import modules
+import actions
+
+# Undo history of the board's modules. A step is what one Engine.do_actions
+# changed, as cell deltas (position, packed module before, packed module
+# after). Every snapshot_every steps the whole board is packed too, so
+# undoing far back restores the nearest snapshot and replays forward from
+# there. Pulses aren't journaled, undo only puts modules back.
+# Modules of types boardfile can't pack are kept by reference.
+
+BEFORE = 1  # indices into a delta
+AFTER = 2
+
+
+def pack(mod: modules.Module):  # b"" for Empty, else a boardfile record
+    if isinstance(mod, modules.Empty):
+        return b""
+    if mod.name.lower() not in boardfile.kinds:
+        return mod
+    return boardfile.pack_module(mod)
+
+
+def unpack(cell, pos: base.Vec2d) -> modules.Module:
+    if isinstance(cell, modules.Module):
+        return cell
+    if not cell:
+        return modules.Empty(pos)
+    return boardfile.unpack_module(np.frombuffer(cell, boardfile.module_dtype)[0])
+
+
+def pack_board(b: 'board.Board') -> Dict[Tuple[int, int], object]:
+    cells = {key: mod for key, mod in b.modules.items()
+             if mod.name.lower() not in boardfile.kinds}
+    cells.update(boardfile.pack_cells(b.modules))
+    return cells
+
+
+class Journal():
+    max_bytes: int = 4000000  # steps and snapshots, oldest steps go first
+    snapshot_every: int = 64  # steps
+    steps: deque  # per step a tuple of (position, before, after)
+    sizes: deque  # bytes per step
+    first: int = 0  # number of the oldest step kept
+    position: int = 0  # steps applied, undo goes back from here
+    # step number -> (packed records, unpackable modules) as of that step
+    snapshots: Dict[int, Tuple[bytes, Dict[Tuple[int, int], modules.Module]]]
+    snapshot_sizes: Dict[int, int]
+    size: int = 0  # bytes of steps and snapshots
+
+    def __init__(self):
+        self.steps = deque()
+        self.sizes = deque()
+        self.snapshots = {}
+        self.snapshot_sizes = {}
+
+    def record(self, b: 'board.Board', deltas: Sequence[tuple]):
+        if not deltas:
+            return
+        # a new step drops everything that could have been redone
+        while len(self.steps) > self.position - self.first:
+            self.steps.pop()
+            self.size -= self.sizes.pop()
+        for n in [n for n in self.snapshots if n > self.position]:
+            self.drop_snapshot(n)
+
+        deltas = tuple(deltas)
+        self.steps.append(deltas)
+        size = sys.getsizeof(deltas) + sum(
+            sys.getsizeof(delta) + sys.getsizeof(delta[0]) + sys.getsizeof(delta[1])
+            + sys.getsizeof(delta[2]) for delta in deltas)
+        self.sizes.append(size)
+        self.size += size
+        self.position += 1
+        if self.position % self.snapshot_every == 0:
+            self.take_snapshot(b)
+
+        while self.size > self.max_bytes and self.steps:
+            self.steps.popleft()
+            self.size -= self.sizes.popleft()
+            self.first += 1
+            for n in [n for n in self.snapshots if n < self.first]:
+                self.drop_snapshot(n)
+
+    def take_snapshot(self, b: 'board.Board'):
+        cells = pack_board(b)
+        recs = b"".join(cell for cell in cells.values() if isinstance(cell, bytes))
+        custom = {key: cell for key, cell in cells.items()
+                  if isinstance(cell, modules.Module)}
+        self.snapshots[self.position] = (recs, custom)
+        self.snapshot_sizes[self.position] = sys.getsizeof(recs) + sys.getsizeof(custom)
+        self.size += self.snapshot_sizes[self.position]
+
+    def drop_snapshot(self, n: int):
+        del self.snapshots[n]
+        self.size -= self.snapshot_sizes.pop(n)
+
+    def restore_snapshot(self, b: 'board.Board', n: int):
+        recs, custom = self.snapshots[n]
+        grid, _ = boardfile.build(b.dim, np.frombuffer(recs, boardfile.module_dtype),
+                                  np.zeros(0, dtype=boardfile.pulse_dtype))
+        grid.update(custom)
+        b.set_contents(grid, b.get_pulses())
+
+    def apply(self, b: 'board.Board', step: Sequence[tuple], which: int):
+        # puts the BEFORE or AFTER module of every delta in place
+        for delta in step:
+            pos = base.Vec2d(*delta[0])
+            b.do_action(actions.setModule(unpack(delta[which], pos)), pos)
+
+    def undo(self, b: 'board.Board', count: int = 1) -> int:
+        target = max(self.first, self.position - count)
+        undone = self.position - target
+        usable = [n for n in self.snapshots if target >= n]
+        nearest = max(usable) if usable else None
+        if nearest is not None and target - nearest < undone:
+            self.restore_snapshot(b, nearest)
+            for i in range(nearest, target):
+                self.apply(b, self.steps[i - self.first], AFTER)
+        else:
+            for i in range(self.position - 1, target - 1, -1):
+                self.apply(b, reversed(self.steps[i - self.first]), BEFORE)
+        self.position = target
+        return undone
+
+    def redo(self, b: 'board.Board', count: int = 1) -> int:
+        target = min(self.first + len(self.steps), self.position + count)
+        redone = target - self.position
+        for i in range(self.position, target):
+            self.apply(b, self.steps[i - self.first], AFTER)
+        self.position = target
+        return redone
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "undo": self.position - self.first,
+            "redo": self.first + len(self.steps) - self.position,
+            "snapshots": len(self.snapshots),
+            "bytes": self.size,
+        }
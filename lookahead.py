@@ -0,0 +1,69 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict
+from collections import deque
+import numpy as np
+import base
+import board
+import clock
+import cycle
+import midi
+
+# Between edits the board is deterministic, so the clock thread simulates
+# it some beats ahead and hands the notes to the midi scheduler stamped with
+# the time their beat is due. A slow tick or frame then only delays the
+# simulation, not the notes. The board's pulses run ahead of the screen,
+# which shows the recorded frame of the current beat instead.
+# An edit happens at the beat on screen: the pulses go back to that beat's,
+# the notes scheduled after it are cancelled and the window fills again,
+# fill beats per tick. The first beat after an edit is simulated when it
+# is due, like without lookahead.
+
+
+class Lookahead():
+    beats: int  # window length, 0 simulates each beat when it is due
+    fill: int = 2  # beats simulated per tick at most
+    clock: clock.BeatClock
+    # per simulated beat (beat, pulse state, position snapshot, pulse count),
+    # the first one is on screen
+    frames: deque
+    missed: int = 0  # clock.missed the scheduled times are based on, see due
+
+    def __init__(self, beat_clock: clock.BeatClock, beats: int = base.LOOKAHEAD):
+        self.clock = beat_clock
+        self.beats = beats
+        self.frames = deque()
+
+    def tick(self, b: board.Board, cache: cycle.CycleCache, beats: int):
+        if self.clock.missed != self.missed:
+            # the clock skipped beats, so the scheduled times are off
+            self.rewind(b, cache)
+            self.missed = self.clock.missed
+        while self.frames and self.frames[0][0] < beats:
+            self.frames.popleft()
+        beat = self.frames[-1][0] + 1 if self.frames else beats
+        simulated = 0
+        while beat <= beats + self.beats and (simulated < self.fill or beat <= beats):
+            self.simulate(b, cache, beat)
+            beat += 1
+            simulated += 1
+        beat, state, b.pulse_snapshot, b.pulse_count = self.frames[0]
+
+    def simulate(self, b: board.Board, cache: cycle.CycleCache, beat: int):
+        cache.update(b, beat)
+        midi.midi.flush(at=self.due(beat))
+        # a replaying cache leaves the board's own pulses behind
+        state = cache.history[cache.current][0] if cache.stale else \
+            b.get_pulse_state().tobytes()
+        self.frames.append((beat, state, b.pulse_snapshot, b.pulse_count))
+
+    def due(self, beat: int) -> float:  # as scheduled, while no beats are missed
+        return self.clock.origin + (beat + self.missed)*self.clock.step
+
+    def rewind(self, b: board.Board, cache: cycle.CycleCache):
+        # before anything edits b
+        cache.reset(b)
+        if len(self.frames) > 1:
+            beat, state, snapshot, count = self.frames[0]
+            b.set_pulse_state(np.frombuffer(state, dtype=np.int64))
+            midi.midi.cancel_after(self.due(beat) + self.clock.step/2)
+            self.frames = deque([self.frames[0]])
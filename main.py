@@ -1,18 +1,49 @@
+import argparse
 import base
 import modules
 import engine
+import midi
+import profiler
+import control
 import tcod
 
-base.root_console.default_fg = base.cols["outer_fg"]
-base.root_console.default_bg = base.cols["outer_bg"]
-base.root_console.clear()
-base.root_console.draw_frame(1, 1, base.SCREEN_WIDTH-2, base.SCREEN_HEIGHT-2,
-                             "ilomusi")
-for x, y in [(0, 0), (0, base.SCREEN_HEIGHT-1), (base.SCREEN_WIDTH-1, 0), (base.SCREEN_WIDTH-1, base.SCREEN_HEIGHT-1)]:
-    tcod.console_put_char(base.root_console, x, y,
-                          "O", tcod.BKGND_NONE)
 
-while True:
-    engine.eng.update()
-    engine.eng.render()
-    tcod.console_flush()
+def main():
+    parser = argparse.ArgumentParser(description="ilomusi")
+    parser.add_argument("--profile-log", help="append per frame timings to this csv file")
+    parser.add_argument("--control", help="serve the control api on this unix socket path or host:port")
+    args = parser.parse_args()
+    if args.profile_log:
+        profiler.prof.open_log(args.profile_log)
+
+    base.init_display()
+    midi.init(dispatch=base.MIDI_DISPATCH)
+    base.root_console.default_fg = base.cols["outer_fg"]
+    base.root_console.default_bg = base.cols["outer_bg"]
+    base.root_console.clear()
+    base.root_console.draw_frame(1, 1, base.SCREEN_WIDTH-2, base.SCREEN_HEIGHT-2,
+                                 "ilomusi")
+    for x, y in [(0, 0), (0, base.SCREEN_HEIGHT-1), (base.SCREEN_WIDTH-1, 0), (base.SCREEN_WIDTH-1, base.SCREEN_HEIGHT-1)]:
+        tcod.console_put_char(base.root_console, x, y,
+                              "O", tcod.BKGND_NONE)
+
+    engine.eng.start()
+    if args.control:
+        server = control.ControlServer(engine.eng)
+        server.start(args.control)
+        print("control api on", server.address)
+    while True:
+        events = engine.eng.wait()
+        profiler.prof.begin()
+        engine.eng.update(events)
+        profiler.prof.mark("input")
+        if not engine.eng.frame_due():
+            continue
+        engine.eng.render()
+        tcod.console_flush()
+        profiler.prof.mark("flush")
+        profiler.prof.end_frame(engine.eng.board.pulse_count, engine.eng.beats)
+
+
+if __name__ == "__main__":  # the midi and shards processes import this module too
+    main()
@@ -1,28 +1,164 @@
 import time
-import rtmidi
+import heapq
+import threading
 from threading import Thread
+from typing import Tuple, Sequence, Callable
+import mididispatch
 
+Message = Sequence[int]
+
+
+class NullMidiOut():  # for headless runs, sends nowhere
+    def send_message(self, message: Message):
+        pass
+
+
+class RecordingMidiOut():  # stands in for rtmidi.MidiOut, keeps what was sent
+    def __init__(self, now: Callable[[], float] = time.perf_counter):
+        self.now = now
+        self.messages = []  # (time, message)
+
+    def send_message(self, message: Message):
+        self.messages.append((self.now(), list(message)))
+
+
+class Scheduler():  # one sender thread for every timed midi message
+    def __init__(self, midiout, max_events: int = 4096,
+                 now: Callable[[], float] = time.perf_counter):
+        self.midiout = midiout
+        self.max_events = max_events
+        self.now = now
+        self.events = []  # heap of (time, seq, message, time of the group's first message)
+        self.seq = 0  # keeps messages with equal times in order
+        self.max_depth = 0
+        self.dropped = 0  # groups rejected because the queue was full
+        self.dropped_cancels = 0  # cancels always apply here, see RingScheduler
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def schedule(self, events: Sequence[Tuple[float, Message]]) -> bool:
+        # all or nothing, so a note-on never loses its note-off
+        with self.cond:
+            if len(self.events) + len(events) > self.max_events:
+                self.dropped += 1
+                return False
+            first = min(t for t, message in events)
+            for t, message in events:
+                heapq.heappush(self.events, (t, self.seq, message, first))
+                self.seq += 1
+            self.max_depth = max(self.max_depth, len(self.events))
+            self.cond.notify()
+        if not self.thread:
+            self.thread = Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return True
+
+    def cancel(self, after: float) -> bool:
+        # drops the groups that start after the given time, whole, so the
+        # note-offs of notes already playing stay
+        with self.cond:
+            self.events = [e for e in self.events if e[3] <= after]
+            heapq.heapify(self.events)
+        return True
+
+    def depth(self) -> int:
+        return len(self.events)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.events or self.events[0][0] > self.now():
+                    timeout = self.events[0][0] - self.now() if self.events else None
+                    self.cond.wait(timeout)
+                due = []
+                while self.events and self.events[0][0] <= self.now():
+                    due.append(heapq.heappop(self.events)[2])
+            for message in due:
+                self.midiout.send_message(message)
 
-class Midi():
-    def __init__(self):
-        self.midiout = rtmidi.MidiOut()
-        self.available_ports = self.midiout.get_ports()
-        print(self.available_ports)
-        if not self.available_ports:
-            print ("No midi server found! Functionality disabled.")
 
-        self.midiout.open_port(0)   #TODO: choose
+def open_port():  # port 0 of the midi server
+    import rtmidi  # needs a midi server, so only imported on demand
+    midiout = rtmidi.MidiOut()
+    available_ports = midiout.get_ports()
+    print(available_ports)
+    if not available_ports:
+        print ("No midi server found! Functionality disabled.")
 
+    midiout.open_port(0)   #TODO: choose
+    return midiout
 
-    def note_thread(self, note, channel, duration):
-        note_on = [0x90 + channel, note, 112] # channel 1, middle C, velocity 112
+
+class Midi():
+    stacking: str = "max"  # velocity of merged hits: "max", "sum" or "first"
+    tick_budget: int = 64  # messages sent per tick at most
+    saved: int = 0  # messages merged away
+    over_budget: int = 0  # messages dropped by the budget
+
+    def __init__(self, midiout=None, max_events: int = 4096, scheduler=None):
+        # the scheduler owns the port, a mididispatch.RingScheduler opens
+        # its own in the dispatcher process
+        if scheduler is None:
+            scheduler = Scheduler(midiout if midiout is not None else open_port(), max_events)
+        self.scheduler = scheduler
+        self.batch = {}  # (channel, note) -> [velocity, duration]
+
+    def play_note(self, note, channel = 0, duration = 0.2, velocity = 112, at: float = None):
+        # at is a scheduler.now() time, now if None
+        at = self.scheduler.now() if at is None else at
+        note_on = [0x90 + channel, note, velocity]
         note_off = [0x80 + channel, note, 0]
-        self.midiout.send_message(note_on)
-        time.sleep(duration)
-        self.midiout.send_message(note_off)
+        self.scheduler.schedule([(at, note_on), (at + duration, note_off)])
+
+    def queue_note(self, note, channel = 0, duration = 0.2, velocity = 112):
+        # collected until the end of the tick, see flush
+        key = (channel, note)
+        if key not in self.batch:
+            self.batch[key] = [velocity, duration]
+            return
+        hit = self.batch[key]
+        if self.stacking == "max":
+            hit[0] = max(hit[0], velocity)
+        elif self.stacking == "sum":
+            hit[0] = min(127, hit[0] + velocity)
+        hit[1] = max(hit[1], duration)
+        self.saved += 2
+
+    def take_batch(self) -> Sequence[Tuple[int, int, float, int]]:
+        # (note, channel, duration, velocity) per merged hit, within budget
+        notes = [(note, channel, duration, velocity) for (channel, note),
+                 (velocity, duration) in self.batch.items()]
+        self.batch = {}
+        allowed = self.tick_budget // 2
+        if len(notes) > allowed:
+            self.over_budget += 2*(len(notes) - allowed)
+            notes = notes[:allowed]
+        return notes
+
+    def flush(self, at: float = None):  # once per tick
+        for note, channel, duration, velocity in self.take_batch():
+            self.play_note(note, channel, duration, velocity, at)
+
+    def cancel_after(self, at: float):  # notes starting after at won't play
+        self.scheduler.cancel(at)
+
+    def queue_depth(self) -> int:
+        return self.scheduler.depth()
+
+
+def init(midiout=None, dispatch: bool = False):
+    # at startup, opens port 0 unless given a sink; dispatch sends from a
+    # separate process, given a picklable function returning the sink
+    global midi
+    if dispatch:
+        try:
+            midi = Midi(scheduler=mididispatch.RingScheduler(
+                midiout if midiout is not None else open_port))
+            return
+        except RuntimeError as e:
+            print(e, "- sending from the main process instead")
+            midiout = midiout() if callable(midiout) else midiout
+    midi = Midi(midiout)
 
-    def play_note(self, note, channel = 0, duration = 0.2):
-        t = Thread(target=self.note_thread, args=(note, channel, duration))
-        t.start()
 
-midi = Midi()
+midi = Midi(NullMidiOut())  # replaced by init
@@ -0,0 +1,179 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Callable
+import atexit
+import heapq
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+import numpy as np
+
+# Midi port I/O in a process of its own, so a slow frame or a long tick in
+# the engine can't hold notes back. The engine writes timestamped messages
+# into a single producer, single consumer ring in shared memory and the
+# dispatcher reads it, keeps the messages in a heap and sends them when due.
+# A slot with status 0 isn't sent, it cancels the groups starting after its
+# time (see Scheduler.cancel).
+# No locks: only the producer moves head and only the consumer moves tail,
+# and head is moved after the slots are written. time.perf_counter is the
+# system wide monotonic clock on Linux, so both sides agree on the times.
+# The dispatcher sleeps until the next message is due, or until the
+# producer sets the wake event after writing.
+
+Message = Sequence[int]
+
+# header fields, int64 each
+HEAD = 0  # slots written, by the producer
+TAIL = 1  # slots taken, by the consumer
+STOP = 2  # set by the producer to end the dispatcher
+PENDING = 3  # taken but not yet due, by the consumer
+SENT = 4  # by the consumer
+HEADER = 8
+
+slot_dtype = np.dtype({"names": ["time", "first", "status", "data1", "data2"],
+                       "formats": ["<f8", "<f8", "u1", "u1", "u1"],
+                       "offsets": [0, 8, 16, 17, 18], "itemsize": 24})
+CANCEL = 0  # status of a cancel slot
+POLL = 0.001  # seconds the producer waits for room in the ring
+IDLE = 1.0  # seconds the dispatcher sleeps at most
+
+
+def views(shm: shared_memory.SharedMemory, capacity: int) -> Tuple[np.ndarray, np.ndarray]:
+    header = np.ndarray(HEADER, np.int64, shm.buf)
+    slots = np.ndarray(capacity, slot_dtype, shm.buf, offset=8*HEADER)
+    return header, slots
+
+
+def dispatch(name: str, capacity: int, make_port: Callable[[], object], conn, wake):
+    # dispatcher process, make_port opens the port here
+    shm = shared_memory.SharedMemory(name=name)
+    header, slots = views(shm, capacity)
+    port = make_port()
+    conn.send("ready")
+    pending = []  # heap of (time, slot number, message, time of the group's first message)
+    while not header[STOP]:
+        wake.clear()  # before reading head, so no write goes unnoticed
+        head, tail = int(header[HEAD]), int(header[TAIL])
+        for i in range(tail, head):
+            slot = slots[i % capacity]
+            if slot["status"] == CANCEL:
+                pending = [e for e in pending if e[3] <= slot["time"]]
+                heapq.heapify(pending)
+                continue
+            heapq.heappush(pending, (float(slot["time"]), i, [
+                int(slot["status"]), int(slot["data1"]), int(slot["data2"])],
+                float(slot["first"])))
+        header[TAIL] = head
+        now = time.perf_counter()
+        while pending and pending[0][0] <= now:
+            port.send_message(heapq.heappop(pending)[2])
+            header[SENT] += 1
+        header[PENDING] = len(pending)
+        wake.wait(min(IDLE, pending[0][0] - now) if pending else IDLE)
+    # a recording port goes back to whoever stopped the dispatcher
+    conn.send(getattr(port, "messages", None))
+    conn.close()
+    del header, slots
+    shm.close()
+
+
+class RingScheduler():  # Scheduler with the sending in a dispatcher process
+    capacity: int
+    dropped: int = 0  # groups rejected because max_events were waiting
+    max_depth: int = 0
+    dead: bool = False  # the dispatcher exited, reported once
+    cancel_tries: int = 5  # polls a cancel waits for room in the ring
+    dropped_cancels: int = 0  # those notes play anyway
+
+    def __init__(self, make_port: Callable[[], object], max_events: int = 4096,
+                 now: Callable[[], float] = time.perf_counter, start_timeout: float = 10.0):
+        self.capacity = max_events
+        self.now = now
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=8*HEADER + slot_dtype.itemsize*max_events)
+        self.header, self.slots = views(self.shm, max_events)
+        self.header[:] = 0
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.wake = ctx.Event()
+        self.proc = ctx.Process(target=dispatch, daemon=True,
+                                args=(self.shm.name, max_events, make_port, child, self.wake))
+        self.proc.start()
+        child.close()
+        # the port opens in the dispatcher, wait until it did
+        try:
+            ready = self.conn.poll(start_timeout) and self.conn.recv() == "ready"
+        except EOFError:
+            ready = False
+        if not ready:
+            self.proc.join(1)
+            if self.proc.is_alive():
+                self.proc.kill()
+                self.proc.join()
+            self.release()
+            raise RuntimeError("midi dispatcher did not start, exit code %s"
+                               % self.proc.exitcode)
+        atexit.register(self.close)
+
+    def schedule(self, events: Sequence[Tuple[float, Message]]) -> bool:
+        # all or nothing, so a note-on never loses its note-off
+        first = min(t for t, message in events)
+        if self.depth() + len(events) > self.capacity or \
+                not self.write([(t, first, message) for t, message in events]):
+            self.dropped += 1
+            if not self.dead and not self.proc.is_alive():
+                self.dead = True
+                print("midi dispatcher exited with code", self.proc.exitcode,
+                      "- notes are dropped")
+            return False
+        self.max_depth = max(self.max_depth, self.depth())
+        return True
+
+    def cancel(self, after: float) -> bool:
+        # queued like a message, so it only drops what was scheduled before;
+        # callers hold the engine lock, so a full ring is waited on briefly
+        # and then the cancel is dropped and counted
+        for i in range(self.cancel_tries):
+            if self.write([(after, after, (CANCEL, 0, 0))]):
+                return True
+            time.sleep(POLL)
+        self.dropped_cancels += 1
+        return False
+
+    def write(self, entries: Sequence[Tuple[float, float, Message]]) -> bool:
+        head = int(self.header[HEAD])
+        if head - int(self.header[TAIL]) + len(entries) > self.capacity:
+            return False
+        for i, (t, first, message) in enumerate(entries):
+            slot = self.slots[(head + i) % self.capacity]
+            slot["time"], slot["first"] = t, first
+            slot["status"], slot["data1"], slot["data2"] = message
+        self.header[HEAD] = head + len(entries)
+        self.wake.set()
+        return True
+
+    def depth(self) -> int:  # written and not yet sent
+        return int(self.header[HEAD] - self.header[TAIL] + self.header[PENDING])
+
+    def sent(self) -> int:
+        return int(self.header[SENT])
+
+    def close(self) -> Sequence[Tuple[float, Message]]:
+        # stops the dispatcher, returns what a recording port got
+        if self.shm is None:
+            return None
+        atexit.unregister(self.close)
+        self.header[STOP] = 1
+        self.wake.set()
+        try:
+            messages = self.conn.recv() if self.conn.poll(5) else None
+        except EOFError:  # the dispatcher died
+            messages = None
+        self.proc.join(1)
+        self.release()
+        return messages
+
+    def release(self):
+        del self.header, self.slots
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
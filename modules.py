@@ -1,10 +1,12 @@
 from __future__ import annotations
 from typing import Tuple, Sequence, Dict, Set
 import abc
+import functools
 import base
 import pulse
 import tcod
 import midi
+import props
 
 
 class Module(abc.ABC):
@@ -15,6 +17,8 @@ class Module(abc.ABC):
     pos: base.Vec2d  # position on the borad (x,y)
     col_fg: int  # fg color of the central symbol
     col_bg: int  # bg color of the central symbol
+    tile_ids: Tuple[int, int, int] = None  # cached by tiles.cache
+    schema: Dict[str, props.Prop] = {}  # editable properties, per class
 
     def __init__(self, pos: base.Vec2d, symbol: base.Symbol = None):
         self.pos = pos
@@ -36,14 +40,20 @@ class Module(abc.ABC):
     def on_beat(self, beats) -> Sequence[pulse.Pulse]:
         return []
 
-    @abc.abstractmethod
-    # props = dict of (value, type, description)
-    def get_exposed_props(self) -> Dict[str, Tuple[str, str, str]]:
+    # on_pulse compiled into a table, used by Board.step_pulses instead of
+    # calling it: per incoming direction at base.dir_slot, a tuple of
+    # (outgoing directions, (note, channel, duration, velocity) to queue
+    # or None). None means it can't be compiled and on_pulse is called.
+    def transfer(self) -> Sequence[Tuple[Sequence[base.Vec2d], tuple]]:
         return None
 
-    @abc.abstractmethod
-    def set_exposed_props(self, props: Dict[str, Tuple[str, str, str]]):
-        pass
+    def get_props(self) -> Dict[str, object]:  # native values by name
+        return {name: prop.get(self) for name, prop in self.schema.items()}
+
+    def set_props(self, values: Dict[str, object]):
+        for name, value in values.items():
+            self.schema[name].set(self, value)
+        self.tile_ids = None  # the look may have changed
 
 
 class Empty(Module):
@@ -53,12 +63,6 @@ class Empty(Module):
     def get_chunk(self):
         return None
 
-    def get_exposed_props(self):
-        return super().get_exposed_props()
-
-    def set_exposed_props(self, props):
-        pass
-
 
 class Spreader(Module):
     name: str = "Spreader"
@@ -68,54 +72,28 @@ class Spreader(Module):
     inp: Sequence[base.Vec2d] = [base.DIR_DOWN, base.DIR_UP,
                                  base.DIR_LEFT, base.DIR_RIGHT]
     outp: Sequence[base.Vec2d] = [base.DIR_RIGHT]
+    schema = props.schema(*props.symbol_props(),
+                          *props.dir_props("inp", "input"),
+                          *props.dir_props("outp", "output"))
 
     def on_pulse(self, p):
+        out_pulses = []
         if p.direction in self.inp:
-            out_pulses = []
-            for o in self.outp:
-                np = pulse.Pulse(p.pos, o)
-                np.move()
-                out_pulses.append(np)
+            last = len(self.outp) - 1
+            for i, o in enumerate(self.outp):
+                # the incoming pulse is reused for the last output
+                new_pulse = pulse.Pulse(p.pos, o) if i < last else p
+                new_pulse.direction = o
+                new_pulse.move()
+                out_pulses.append(new_pulse)
         return out_pulses
 
-    def get_exposed_props(self):
-        props = {
-            "character": (self.symbol[0], "char", "character"),
-            "color": (str(self.symbol[1]), "color", "color"),
-            "up_is_input": (str(base.DIR_UP in self.inp), "bool",
-                            "up is input"),
-            "down_is_input": (str(base.DIR_DOWN in self.inp), "bool",
-                              "down is input"),
-            "left_is_input": (str(base.DIR_LEFT in self.inp), "bool",
-                              "left is input"),
-            "right_is_input": (str(base.DIR_RIGHT in self.inp), "bool",
-                               "right is input"),
-            "up_is_output": (str(base.DIR_UP in self.outp), "bool",
-                             "up is output"),
-            "down_is_output": (str(base.DIR_DOWN in self.outp), "bool",
-                               "down is output"),
-            "left_is_output": (str(base.DIR_LEFT in self.outp), "bool",
-                               "left is output"),
-            "right_is_output": (str(base.DIR_RIGHT in self.outp), "bool",
-                                "right is output")
-        }
-        return props
-
-    def set_exposed_props(self, props):
-        props = {key: value[0] for key, value in props.items()}
-        color = tuple(int(x) for x in props["color"][1:-1].split(","))
-        self.symbol = (props["character"], color, self.symbol[2])
-
-        self.inp = []
-        self.inp += [base.DIR_UP] if props["up_is_input"] == "t" else []
-        self.inp += [base.DIR_DOWN] if props["down_is_input"] == "t" else []
-        self.inp += [base.DIR_LEFT] if props["left_is_input"] == "t" else []
-        self.inp += [base.DIR_RIGHT] if props["right_is_input"] == "t" else []
-        self.outp = []
-        self.outp += [base.DIR_UP] if props["up_is_output"] == "t" else []
-        self.outp += [base.DIR_DOWN] if props["down_is_output"] == "t" else []
-        self.outp += [base.DIR_LEFT] if props["left_is_output"] == "t" else []
-        self.outp += [base.DIR_RIGHT] if props["right_is_output"] == "t" else []
+    def transfer(self):
+        table = [None]*9
+        for d in base.DIRS:
+            table[base.dir_slot(d)] = (tuple(self.outp) if d in self.inp
+                                       else (), None)
+        return tuple(table)
 
 
 class Emitter(Module):
@@ -126,6 +104,10 @@ class Emitter(Module):
     outp: Sequence[base.Vec2d] = [base.DIR_UP]
     interval: int = 5  # (beats % interval == 0) => pulse
     offset: int = 0  # offset off the interval
+    schema = props.schema(*props.symbol_props(),
+                          *props.dir_props("outp", "output"),
+                          props.AttrProp("interval", props.IntType(1), "pulse interval"),
+                          props.AttrProp("offset", props.INT, "pulse offset"))
 
     def on_beat(self, beats) -> Sequence[pulse.Pulse]:
         if beats % self.interval - self.offset == 0:
@@ -133,52 +115,33 @@ class Emitter(Module):
 
         return []
 
-    def get_exposed_props(self):
-        props = {
-            "character": (self.symbol[0], "char", "character"),
-            "color": (str(tuple(self.symbol[1])), "color", "color"),
-            "up_is_output": (str(base.DIR_UP in self.outp), "bool",
-                             "up is output"),
-            "down_is_output": (str(base.DIR_DOWN in self.outp), "bool",
-                               "down is output"),
-            "left_is_output": (str(base.DIR_LEFT in self.outp), "bool",
-                               "left is output"),
-            "right_is_output": (str(base.DIR_RIGHT in self.outp), "bool",
-                                "right is output"),
-            "interval": (str(self.interval), "int", "pulse interval"),
-            "offset": (str(self.offset), "int", "pulse offset")
-        }
-        return props
-
-    def set_exposed_props(self, props):
-        props = {key: value[0] for key, value in props.items()}
-        color = tuple(int(x) for x in props["color"][1:-1].split(","))
-        self.symbol = (props["character"], color, self.symbol[2])
-
-        self.outp = []
-        self.outp += [base.DIR_UP] if props["up_is_output"] == "t" else []
-        self.outp += [base.DIR_DOWN] if props["down_is_output"] == "t" else []
-        self.outp += [base.DIR_LEFT] if props["left_is_output"] == "t" else []
-        self.outp += [base.DIR_RIGHT] if props["right_is_output"] == "t" else []
-
-        self.interval = int(props["interval"])
-        self.offset = int(props["offset"])
-
 class Output(Module):
     symbol = ("u", base.cols["source_fg"], base.cols["bg"])
     name = "Output"
+    note: int = 80
+    duration: float = 0.05
+
     def __init__(self, pos, symbol=None):
          return super().__init__(pos, symbol)
 
     def on_pulse(self, p):
-        midi.midi.play_note(80, duration=0.05);
+        midi.midi.queue_note(self.note, duration=self.duration)
         return []
 
-    def get_exposed_props(self):
-        return super().get_exposed_props()
+    def transfer(self):
+        table = [None]*9
+        for d in base.DIRS:
+            table[base.dir_slot(d)] = ((), (self.note, 0, self.duration, 112))
+        return tuple(table)
+
 
-    def set_exposed_props(self, props):
-        pass
+@functools.cache  # per class, asked for every cell of a loaded board
+def compiles(cls) -> bool:
+    # transfer is only trusted if it is at least as specific as on_pulse,
+    # so a subclass that just overrides on_pulse isn't compiled
+    def owner(name):
+        return next(c for c in cls.__mro__ if name in c.__dict__)
+    return issubclass(owner("transfer"), owner("on_pulse"))
 
 
 names = ["spreader", "emitter", "empty", "output"]
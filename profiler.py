@@ -0,0 +1,99 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict, TextIO
+from collections import deque
+import os
+import time
+import base
+import clock
+
+
+class Profiler():  # per phase timings of the main loop
+    overlay: bool = False  # toggled with F3
+    phases: Dict[str, deque]  # seconds per frame, rolling
+    history: int
+    last: float = 0
+    frame: Dict[str, float]  # phases of the frame in progress
+    unlogged: Dict[str, deque]  # samples from other threads since the last frame
+    log: TextIO = None
+    log_path: str = None
+    log_max_bytes: int = 0
+    log_columns: Sequence[str] = ()
+
+    def __init__(self, history: int = 300):
+        self.history = history
+        self.phases = {}
+        self.frame = {}
+        self.unlogged = {}
+
+    def begin(self):
+        self.frame = {}
+        self.last = time.perf_counter()
+
+    def mark(self, phase: str):  # time since the last mark belongs to phase
+        now = time.perf_counter()
+        self.add(phase, now - self.last)
+        self.frame[phase] = now - self.last
+        self.last = now
+
+    def record(self, phase: str, seconds: float, overlay: bool = True):
+        # from other threads, logged with the next frame as count and max
+        if overlay:
+            self.add(phase, seconds)
+        if self.log:
+            self.unlogged.setdefault(phase, deque()).append(seconds)
+
+    def add(self, phase: str, seconds: float):
+        if phase not in self.phases:
+            self.phases[phase] = deque(maxlen=self.history)
+        self.phases[phase].append(seconds)
+
+    def stats(self) -> Dict[str, Tuple[float, float]]:  # (mean, p95) in ms
+        stats = {}
+        for phase, samples in list(self.phases.items()):
+            samples = list(samples)
+            if samples:
+                stats[phase] = (1000*sum(samples)/len(samples),
+                                1000*clock.percentiles(samples, (95,))[0])
+        return stats
+
+    def render(self, pulses: int, jitter: Dict[str, float]):
+        if not self.overlay:
+            return
+        text = " | ".join("%s %.1f/%.1f" % (phase, mean, p95)
+                          for phase, (mean, p95) in self.stats().items())
+        text += " ms (mean/p95) | pulses %d | jitter p50/p95/p99 %.1f/%.1f/%.1f ms" \
+            % (pulses, jitter["p50"], jitter["p95"], jitter["p99"])
+        base.root_console.print(1, base.SCREEN_HEIGHT-1, text[:base.SCREEN_WIDTH-2],
+                                fg=base.cols["outer_fg"], bg=base.cols["outer_bg"])
+
+    def open_log(self, path: str, max_bytes: int = 10000000):
+        # one csv line per frame, the file is rotated to path.1 when full
+        self.log_path = path
+        self.log_max_bytes = max_bytes
+        self.log = open(path, "a")
+        self.log_columns = ()
+
+    def end_frame(self, pulses: int, beats: int):
+        if not self.log:
+            return
+        other = {}  # popleft while the other thread appends
+        for phase, samples in list(self.unlogged.items()):
+            other[phase] = [samples.popleft() for i in range(len(samples))]
+        columns = tuple(self.frame) + tuple(other)
+        if columns != self.log_columns:
+            self.log.write(",".join(("time", "beats", "pulses") + tuple(self.frame) + tuple(
+                "%s_count,%s_max" % (phase, phase) for phase in other)) + "\n")
+            self.log_columns = columns
+        self.log.write(",".join(
+            ["%.4f,%d,%d" % (time.time(), beats, pulses)] +
+            ["%.3f" % (1000*self.frame[phase]) for phase in self.frame] +
+            ["%d,%s" % (len(samples), "%.3f" % (1000*max(samples)) if samples else "")
+             for samples in other.values()]) + "\n")
+        if self.log.tell() > self.log_max_bytes:
+            self.log.close()
+            os.replace(self.log_path, self.log_path + ".1")
+            self.log = open(self.log_path, "a")
+            self.log_columns = ()
+
+
+prof = Profiler()
@@ -0,0 +1,157 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict
+import abc
+import base
+
+# Typed module properties. Modules keep native values (bool, int, str,
+# color tuples), strings only exist at the editor boundary in parse and
+# format. The descriptors are created once per module class.
+
+
+class PropType(abc.ABC):
+    name: str  # shown in the editor
+
+    @abc.abstractmethod
+    def parse(self, text: str):  # raises ValueError
+        pass
+
+    def format(self, value) -> str:
+        return str(value)
+
+
+class BoolType(PropType):
+    name: str = "bool"
+
+    def parse(self, text: str) -> bool:
+        if text in ("t", "true"):
+            return True
+        if text in ("f", "false"):
+            return False
+        raise ValueError("expected t or f")
+
+    def format(self, value: bool) -> str:
+        return "t" if value else "f"
+
+
+class IntType(PropType):
+    name: str = "int"
+    minimum: int
+    maximum: int  # the default fits the 32 bit fields of board files
+
+    def __init__(self, minimum: int = 0, maximum: int = 2**32 - 1):
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def parse(self, text: str) -> int:
+        value = int(text)
+        if value < self.minimum:
+            raise ValueError("at least %d" % self.minimum)
+        if value > self.maximum:
+            raise ValueError("at most %d" % self.maximum)
+        return value
+
+
+class CharType(PropType):
+    name: str = "char"
+
+    def parse(self, text: str) -> str:
+        if len(text) != 1:
+            raise ValueError("expected one character")
+        return text
+
+
+class ColorType(PropType):
+    name: str = "color"
+
+    def parse(self, text: str) -> base.Color:
+        color = tuple(int(c) for c in text.strip("()").split(","))
+        if len(color) != 3 or not all(0 <= c < 256 for c in color):
+            raise ValueError("expected (r, g, b)")
+        return color
+
+    def format(self, value: base.Color) -> str:
+        return "(%d, %d, %d)" % value
+
+
+BOOL = BoolType()
+INT = IntType()
+CHAR = CharType()
+COLOR = ColorType()
+
+
+class Prop(abc.ABC):  # one property of a module class
+    name: str
+    type: PropType
+    description: str
+
+    def __init__(self, name: str, type: PropType, description: str):
+        self.name = name
+        self.type = type
+        self.description = description
+
+    @abc.abstractmethod
+    def get(self, mod):
+        pass
+
+    @abc.abstractmethod
+    def set(self, mod, value):
+        pass
+
+
+class AttrProp(Prop):  # a plain attribute
+    def get(self, mod):
+        return getattr(mod, self.name)
+
+    def set(self, mod, value):
+        setattr(mod, self.name, value)
+
+
+class SymbolProp(Prop):  # the character (0) or color (1) of the symbol
+    index: int
+
+    def __init__(self, name: str, type: PropType, description: str, index: int):
+        super().__init__(name, type, description)
+        self.index = index
+
+    def get(self, mod):
+        value = mod.symbol[self.index]
+        return value if self.index == 0 else tuple(int(c) for c in value)
+
+    def set(self, mod, value):
+        symbol = list(mod.symbol)
+        symbol[self.index] = value
+        mod.symbol = tuple(symbol)
+
+
+class DirProp(Prop):  # whether a direction is in a list of directions
+    attr: str
+    direction: base.Vec2d
+
+    def __init__(self, name: str, description: str, attr: str, direction: base.Vec2d):
+        super().__init__(name, BOOL, description)
+        self.attr = attr
+        self.direction = direction
+
+    def get(self, mod) -> bool:
+        return self.direction in getattr(mod, self.attr)
+
+    def set(self, mod, value: bool):
+        # a new list, the class default is shared
+        current = getattr(mod, self.attr)
+        setattr(mod, self.attr, [d for d in base.DIRS if d == self.direction and value
+                                 or d != self.direction and d in current])
+
+
+def schema(*props: Prop) -> Dict[str, Prop]:
+    return {prop.name: prop for prop in props}
+
+
+def symbol_props() -> Sequence[Prop]:
+    return (SymbolProp("character", CHAR, "character", 0),
+            SymbolProp("color", COLOR, "color", 1))
+
+
+def dir_props(attr: str, role: str) -> Sequence[Prop]:  # e.g. "inp", "input"
+    return tuple(DirProp("%s_is_%s" % (name, role), "%s is %s" % (name, role),
+                         attr, d)
+                 for name, d in zip(("up", "down", "left", "right"), base.DIRS))
@@ -4,15 +4,21 @@ import base
 
 
 class Pulse():
-    pos: base.Vec2d
-    direction: base.Vec2d
+    __slots__ = ("pos", "direction")
+    pos: base.Vec2d  # owned by the pulse and moved in place
+    direction: base.Vec2d  # one of base.DIRS
 
     def __init__(self, pos, direction):
-        self.pos = pos
+        self.pos = base.Vec2d(pos.x, pos.y)
         self.direction = direction
 
     def move(self):
-        self.pos = self.pos + self.direction
+        self.pos.shift(self.direction)
 
     def __eq__(self, other):
         return (self.pos == other.pos) and (self.direction == other.direction)
+
+    # don't move a pulse while it is in a set
+    def __hash__(self):
+        return hash((self.pos.x, self.pos.y,
+                     self.direction.x, self.direction.y))
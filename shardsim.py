@@ -0,0 +1,247 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict, List, Set, FrozenSet
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import tcod
+import base
+import actions
+import board
+import boardfile
+import journal
+import modules
+import pulse
+import vecsim
+
+# Process pool backend for very large boards. The board is cut into strips
+# of columns, each simulated by a worker process with its own headless numpy
+# Board that only holds the strip's modules. A tick has two rounds:
+#   step:  every worker moves its pulses and reports the ones that left its
+#          strip and the ones that hit an Output
+#   merge: the parent routes the leavers to the strips they entered, every
+#          worker drops duplicates and adds what its emitters send
+# Pulses go through shared memory, only short commands through the pipes.
+# Outputs are played by the parent in strip order, so the notes are those
+# of Board.update; the pulses are the same set, in another order.
+
+WORKERS = 4
+
+
+class Buffer():  # int64 array in shared memory, owned by the one process writing it
+    shm: shared_memory.SharedMemory = None
+
+    def write(self, values: np.ndarray) -> str:
+        if self.shm is None or self.shm.size < values.nbytes:
+            self.release()
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=max(4096, 2*values.nbytes))
+        np.ndarray(len(values), np.int64, self.shm.buf)[:] = values
+        return self.shm.name
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class Reader():  # the other side of Buffer
+    shm: shared_memory.SharedMemory = None
+
+    def read(self, name: str, n: int) -> np.ndarray:
+        if self.shm is None or self.shm.name != name:
+            self.close()
+            self.shm = shared_memory.SharedMemory(name=name)
+        return np.array(np.ndarray(n, np.int64, self.shm.buf))
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+
+def work(conn, dim: base.Vec2d, x0: int, x1: int):  # worker process
+    con = tcod.console.Console(3, 3, order="F")
+    b = board.Board(con, base.Vec2d(0, 0), base.Vec2d(3, 3), backend="numpy", dim=dim)
+    conn.send("ready")
+    sim = b.sim
+    state, out, hits = Buffer(), Buffer(), Buffer()
+    reader = Reader()
+    stay = None
+    while True:
+        msg = conn.recv()
+        if msg[0] == "load":
+            recs = np.frombuffer(msg[1], boardfile.module_dtype)
+            grid, _ = boardfile.build(dim, recs, np.zeros(0, dtype=boardfile.pulse_dtype))
+            b.set_contents(grid, [])
+            sim = b.sim
+        elif msg[0] == "set":
+            x, y, cell = msg[1:]
+            pos = base.Vec2d(x, y)
+            b.do_action(actions.setModule(journal.unpack(cell, pos)), pos)
+        elif msg[0] == "pulses":
+            sim.xs, sim.ys, sim.ds = base.key_parts(reader.read(*msg[1:]), dim.y)
+            conn.send((state.write(base.pulse_keys(sim.xs, sim.ys, sim.ds, dim.y)), len(sim.xs)))
+        elif msg[0] == "step":
+            hit = sim.hits(sim.xs, sim.ys)
+            hit_keys = base.pulse_keys(sim.xs[hit], sim.ys[hit], sim.ds[hit], dim.y)
+            nx, ny, nd = sim.move(sim.xs, sim.ys, sim.ds)
+            inside = (nx >= x0) & (nx < x1)
+            stay = nx[inside], ny[inside], nd[inside]
+            # a strip can only receive each leaver once, so drop its
+            # duplicates here and keep the buffer a column high
+            leave = np.unique(base.pulse_keys(nx[~inside], ny[~inside], nd[~inside], dim.y))
+            conn.send((out.write(leave), len(leave), hits.write(hit_keys), len(hit_keys)))
+        elif msg[0] == "merge":
+            beats, name, n = msg[1:]
+            ix, iy, idir = base.key_parts(reader.read(name, n), dim.y)
+            nx, ny, nd = sim.dedup(np.concatenate([stay[0], ix]),
+                                   np.concatenate([stay[1], iy]),
+                                   np.concatenate([stay[2], idir]))
+            ex, ey, ed = sim.emit(beats)
+            sim.xs = np.concatenate([nx, ex]).astype(np.int32)
+            sim.ys = np.concatenate([ny, ey]).astype(np.int32)
+            sim.ds = np.concatenate([nd, ed]).astype(np.int8)
+            conn.send((state.write(base.pulse_keys(sim.xs, sim.ys, sim.ds, dim.y)), len(sim.xs)))
+        elif msg[0] == "close":
+            for buf in (state, out, hits):
+                buf.release()
+            reader.close()
+            conn.close()
+            return
+
+
+class ShardSim():  # sharded backend for Board.update
+    board: 'board.Board'
+    bounds: List[int]  # strip i holds the columns bounds[i] to bounds[i+1]
+    procs: list
+    conns: list
+    inboxes: List[Buffer]  # parent -> worker
+    readers: List[List[Reader]]  # worker -> parent, one per worker buffer
+    states: List[Tuple[str, int]]  # per worker its pulse buffer and count
+    custom: Set[Tuple[int, int]]  # cells the workers can't simulate
+
+    def __init__(self, board: 'board.Board', workers: int = None):
+        self.board = board
+        dim = board.dim
+        workers = max(1, min(workers or WORKERS, dim.x))
+        self.bounds = [dim.x*i//workers for i in range(workers + 1)]
+        ctx = multiprocessing.get_context("spawn")
+        self.procs, self.conns = [], []
+        self.inboxes = [Buffer() for i in range(workers)]
+        self.readers = [[Reader(), Reader(), Reader()] for i in range(workers)]
+        for i in range(workers):
+            conn, child = ctx.Pipe()
+            proc = ctx.Process(target=work, daemon=True,
+                               args=(child, dim, self.bounds[i], self.bounds[i+1]))
+            proc.start()
+            child.close()
+            try:
+                ready = conn.poll(30) and conn.recv() == "ready"
+            except EOFError:
+                ready = False
+            if not ready:
+                proc.join(1)
+                if proc.is_alive():
+                    proc.kill()
+                raise RuntimeError("shard worker %d did not start, exit code %s"
+                                   % (i, proc.exitcode))
+            self.procs.append(proc)
+            self.conns.append(conn)
+        self.load(board.pulses)
+
+    def load(self, pulses: Sequence[pulse.Pulse]):
+        # the board's modules and the given pulses, in the running workers
+        self.custom = set()
+        cells = [[] for conn in self.conns]
+        for key, mod in self.board.modules.items():
+            cell = journal.pack(mod)
+            if isinstance(cell, modules.Module):
+                self.custom.add(key)
+            else:
+                cells[self.shard(key[0])].append(cell)
+        for conn, shard_cells in zip(self.conns, cells):
+            conn.send(("load", b"".join(shard_cells)))
+        self.set_pulses(pulses)
+
+    def shard(self, x: int) -> int:
+        return int(np.searchsorted(self.bounds, x, side="right")) - 1
+
+    def on_cell_changed(self, pos: base.Vec2d):
+        key = (pos.x, pos.y)
+        cell = journal.pack(self.board.module_at(*key))
+        self.custom.discard(key)
+        if isinstance(cell, modules.Module):
+            self.custom.add(key)
+            cell = b""
+        self.conns[self.shard(pos.x)].send(("set", pos.x, pos.y, cell))
+
+    def set_keys(self, keys: np.ndarray):
+        xs = base.key_xs(keys, self.board.dim.y)
+        owner = np.searchsorted(self.bounds, xs, side="right") - 1
+        for i, conn in enumerate(self.conns):
+            part = keys[owner == i]
+            conn.send(("pulses", self.inboxes[i].write(part), len(part)))
+        self.states = [conn.recv() for conn in self.conns]
+
+    def keys(self) -> np.ndarray:
+        return np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            readers[0].read(*state) for readers, state in zip(self.readers, self.states)])
+
+    def set_pulses(self, pulses: Sequence[pulse.Pulse]):
+        n = len(pulses)
+        xs = np.fromiter((p.pos.x for p in pulses), np.int64, n)
+        ys = np.fromiter((p.pos.y for p in pulses), np.int64, n)
+        ds = np.fromiter((base.dir_code(p.direction) for p in pulses), np.int64, n)
+        self.set_keys(base.pulse_keys(xs, ys, ds, self.board.dim.y))
+
+    def get_pulses(self) -> Sequence[pulse.Pulse]:
+        xs, ys, ds = base.key_parts(self.keys(), self.board.dim.y)
+        return [pulse.Pulse(base.Vec2d(x, y), base.DIRS[d])
+                for x, y, d in zip(xs.tolist(), ys.tolist(), ds.tolist())]
+
+    def get_pulse_positions(self) -> FrozenSet[Tuple[int, int]]:
+        xs, ys, ds = base.key_parts(self.keys(), self.board.dim.y)
+        return frozenset(zip(xs.tolist(), ys.tolist()))
+
+    def count(self) -> int:
+        return sum(n for name, n in self.states)
+
+    def update(self, beats: int):
+        if self.custom:
+            # custom modules only have on_pulse, so take the slow path
+            self.set_pulses(self.board.step_pulses(self.get_pulses(), beats))
+            return
+
+        for conn in self.conns:
+            conn.send(("step",))
+        replies = [conn.recv() for conn in self.conns]
+        height = self.board.dim.y
+        leavers = []
+        for readers, (out, n_out, hits, n_hits) in zip(self.readers, replies):
+            leavers.append(readers[1].read(out, n_out))
+            # side effects in strip order, each strip in its pulse order
+            xs, ys, ds = base.key_parts(readers[2].read(hits, n_hits), height)
+            for x, y, d in zip(xs.tolist(), ys.tolist(), ds.tolist()):
+                self.board.modules[(x, y)].on_pulse(
+                    pulse.Pulse(base.Vec2d(x, y), base.DIRS[d]))
+
+        leavers = np.concatenate(leavers)
+        owner = np.searchsorted(self.bounds, base.key_xs(leavers, height), side="right") - 1
+        for i, conn in enumerate(self.conns):
+            part = leavers[owner == i]
+            conn.send(("merge", beats, self.inboxes[i].write(part), len(part)))
+        self.states = [conn.recv() for conn in self.conns]
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(("close",))
+        for proc in self.procs:
+            proc.join()
+        for buf in self.inboxes:
+            buf.release()
+        for readers in self.readers:
+            for reader in readers:
+                reader.close()
+        self.conns = []
+        self.procs = []
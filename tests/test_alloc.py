@@ -0,0 +1,82 @@
+import gc
+import sys
+import pytest
+import base
+import pulse
+from bench import synthetic_board
+
+TICKS = 50
+
+
+def passing_board(backend, pulses):
+    # pass-through pulses all moving right keep their number of positions
+    b = synthetic_board(300, 300, (0, 0, 0), 0, backend=backend)
+    b.set_contents(dict(b.modules), [
+        pulse.Pulse(base.Vec2d(i % 200, i//200 % 200), base.DIR_RIGHT)
+        for i in range(pulses)])
+    for beat in range(1, 4):
+        b.update(beat)
+    return b
+
+
+@pytest.mark.parametrize("backend", ["object", "numpy", "event"])
+def test_tick_allocations_stay_flat(backend, monkeypatch):
+    # counts every Vec2d and Pulse made during a tick, freed or not. The
+    # pulse snapshot is not counted: it is a new frozenset of position tuples
+    # each tick, because the renderer, the cycle cache and the lookahead
+    # frames keep it after the next tick
+    made = []
+    for cls in (base.Vec2d, pulse.Pulse):
+        init = cls.__init__
+
+        def counting(self, *args, init=init):
+            made.append(1)
+            init(self, *args)
+        monkeypatch.setattr(cls, "__init__", counting)
+    counts = {}
+    for pulses in (100, 10000):
+        b = passing_board(backend, pulses)
+        made.clear()
+        for beat in range(4, 4 + TICKS):
+            b.update(beat)
+        assert b.pulse_count == pulses
+        counts[pulses] = len(made)/TICKS
+    assert counts[10000] == counts[100] < 5
+
+
+@pytest.mark.parametrize("backend", ["object", "numpy", "event"])
+@pytest.mark.parametrize("pulses", [100, 10000])
+def test_ticks_do_not_grow_memory(backend, pulses):
+    # once warmed up a tick frees about as many blocks as it allocates
+    b = passing_board(backend, pulses)
+    gc.disable()
+    try:
+        before = sys.getallocatedblocks()
+        for beat in range(4, 4 + TICKS):
+            b.update(beat)
+        after = sys.getallocatedblocks()
+    finally:
+        gc.enable()
+    assert b.pulse_count == pulses
+    assert (after - before)/TICKS < 5
+
+
+@pytest.mark.parametrize("pulses", [100, 10000])
+def test_step_reuses_pulses(pulses):
+    # like bench_allocations: b.pulses keeps the stepped pulses referenced,
+    # so a step allocating new pulses instead of moving them shows up
+    b = synthetic_board(300, 300, (0, 0, 0), 0)
+    b.pulses = [pulse.Pulse(base.Vec2d(i % 200, i//200 % 200),
+                            base.DIR_RIGHT if i % 2 else base.DIR_DOWN)
+                for i in range(pulses)]
+    for beat in range(1, 4):
+        new_pulses = b.step_pulses(b.pulses, beat, b.spare_pulses)
+        b.spare_pulses, b.pulses = b.pulses, new_pulses
+    gc.disable()
+    try:
+        before = sys.getallocatedblocks()
+        b.step_pulses(b.pulses, 4, b.spare_pulses)
+        after = sys.getallocatedblocks()
+    finally:
+        gc.enable()
+    assert after - before < 10
@@ -0,0 +1,68 @@
+import random
+import numpy as np
+import pytest
+import actions
+import base
+import midi
+from bench import synthetic_board, densities
+
+BEATS = 150
+
+
+def edit(r: random.Random, b, w: int, h: int) -> list:
+    # a few edits of the kind made while the board plays, as
+    # (action class, its argument, pos) so each board gets its own action
+    edits = []
+    for i in range(3):
+        pos = base.Vec2d(r.randrange(w), r.randrange(h))
+        edits.append((actions.changeType,
+                      r.choice(["spreader", "emitter", "output", "empty"]), pos))
+    spreaders = sorted(key for key, mod in b.modules.items() if mod.name == "Spreader")
+    emitters = sorted(key for key, mod in b.modules.items() if mod.name == "Emitter")
+    if spreaders:
+        x, y = r.choice(spreaders)
+        name = "%s_is_%s" % (r.choice(["up", "down", "left", "right"]),
+                             r.choice(["input", "output"]))
+        edits.append((actions.changeProperty, {name: r.random() < 0.5}, base.Vec2d(x, y)))
+    if emitters:
+        x, y = r.choice(emitters)
+        edits.append((actions.changeProperty, {"interval": r.randint(1, 6),
+                                               "offset": r.randint(0, 2)},
+                      base.Vec2d(x, y)))
+    return edits
+
+
+@pytest.mark.parametrize("backend", ["numpy", "event", "shards"])
+@pytest.mark.parametrize("density", ["sparse", "dense"])
+def test_backends_match_object(backend, density, monkeypatch):
+    # the same board and edits on the object backend and another one give
+    # the same pulses and notes after every beat. The shards workers are
+    # spawned, so they import shardsim and not this module
+    monkeypatch.setattr(midi, "midi", midi.Midi(midi.NullMidiOut()))
+    notes = []
+
+    def queue_note(note, channel=0, duration=0.2, velocity=112):
+        notes.append((note, channel, duration, velocity))
+    monkeypatch.setattr(midi.midi, "queue_note", queue_note)
+    w, h = 40, 30
+    boards = [synthetic_board(w, h, densities[density], 300, backend=name)
+              for name in ("object", backend)]
+    r = random.Random(7)
+    try:
+        for beat in range(1, BEATS):
+            if beat % 9 == 0:
+                for action, arg, pos in edit(r, boards[0], w, h):
+                    for b in boards:
+                        b.do_action(action(arg), pos)
+            played = []
+            for b in boards:
+                notes.clear()
+                b.update(beat)
+                played.append(sorted(notes))
+            assert np.array_equal(boards[0].get_pulse_state(),
+                                  boards[1].get_pulse_state()), beat
+            assert played[0] == played[1], beat
+            assert boards[0].pulse_count == boards[1].pulse_count, beat
+    finally:
+        for b in boards:
+            b.close()
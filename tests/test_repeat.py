@@ -0,0 +1,59 @@
+import random
+import pytest
+import actions
+import engine
+import journal
+
+
+def expand(ed, cmd: str) -> list:
+    # exec_command without run-length actions: every block copied count times
+    out = []
+    staged = []
+    multiplier = None
+    for c in cmd:
+        if c.isnumeric():
+            if staged:
+                out += staged*(1 if multiplier is None else multiplier)
+                staged = []
+                multiplier = None
+            multiplier = (multiplier or 0)*10 + int(c)
+        else:
+            staged.append(ed.keytable[c])
+    return out + staged*(1 if multiplier is None else multiplier)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_repeat_matches_expansion(seed):
+    # cursor runs are folded into one clamped move and idempotent rounds are
+    # cut short, so compare against doing every copy of the block
+    folded, expanded = engine.Engine(), engine.Engine()
+    r = random.Random(seed)
+    for i in range(300):
+        cmd = "".join(r.choice("hjklhjklqweru" + "0123456789"*(r.random() < 0.5))
+                      for j in range(r.randint(1, 6)))
+        if cmd.isnumeric():
+            continue
+        folded.do_actions(folded.editor.exec_command(cmd) or [])
+        expanded.do_actions(expand(expanded.editor, cmd))
+        assert folded.editor.cursor == expanded.editor.cursor, cmd
+        assert journal.pack_board(folded.board) == journal.pack_board(expanded.board), cmd
+        assert folded.journal.position == expanded.journal.position, cmd
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_power_matches_moves(seed):
+    # a run of clamped cursor moves raised to a count, from every start
+    r = random.Random(seed)
+    size = r.randint(1, 12)
+    moves = [r.choice([-1, 0, 1]) for i in range(r.randint(1, 5))]
+    count = r.randint(0, 30)
+    f = (0, 0, size - 1)
+    for d in moves:
+        f = actions.compose(f, actions.clamped_move(d, size))
+    f = actions.power(f, count)
+    for start in range(size):
+        x = start
+        for i in range(count):
+            for d in moves:
+                x = min(max(x + d, 0), size - 1)
+        assert actions.apply_move(f, start) == x, (moves, count, start)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict
+import numpy as np
+import tcod
+import base
+
+# tile variants per module look
+NORMAL = 0
+CURSOR = 1
+PULSE = 2
+STATES = (NORMAL, CURSOR, PULSE)
+
+state_cols = {  # (fg, bg) overrides
+    NORMAL: (None, None),
+    CURSOR: (base.cols["cursor_fg"], base.cols["cursor_bg"]),
+    PULSE: (base.cols["pulse_fg"], base.cols["pulse_bg"]),
+}
+
+
+def draw_chunk(con: tcod.console.Console, chunk: base.Chunk, pos: base.Vec2d,
+               fg: base.Color = None, bg: base.Color = None):
+    render_pos = pos.mul(3)
+    if not chunk:
+        con.default_fg = con.default_bg = con.default_bg if not bg else bg
+        con.draw_frame(render_pos.x, render_pos.y, 3, 3,
+                       fg=con.default_fg,
+                       bg=con.default_bg, clear=True)
+        con.default_fg = base.cols["inactive"] if not fg else fg
+        tcod.console_put_char(con, render_pos.x+1,
+                              render_pos.y+1, "=", tcod.BKGND_SET)
+        con.default_fg = base.cols["fg"]
+        con.default_bg = base.cols["bg"]
+        return
+
+    con.default_fg = chunk[1][1][1] if not fg else fg
+    con.default_bg = chunk[1][1][2] if not bg else bg
+    con.draw_frame(render_pos.x, render_pos.y, 3, 3,
+                   fg=con.default_fg,
+                   bg=con.default_bg, clear=True)
+    for x in range(3):
+        for y in range(3):
+            if chunk[x][y]:
+                con.default_fg = chunk[x][y][1] if not fg else fg
+                tcod.console_put_char(con, render_pos.x+x,
+                                      render_pos.y+y,
+                                      chunk[x][y][0], tcod.BKGND_SET)
+                con.default_fg = base.cols["fg"]
+    con.default_bg = base.cols["bg"]
+
+
+class TileCache():  # every module look rasterized once, indexed by tile id
+    ch: np.ndarray  # (tiles, 3, 3)
+    fg: np.ndarray  # (tiles, 3, 3, 3)
+    bg: np.ndarray  # (tiles, 3, 3, 3)
+    ids: Dict[Tuple[type, str], Tuple[int, int, int]]
+    scratch: tcod.console.Console
+
+    def __init__(self):
+        self.ch = np.zeros((0, 3, 3), dtype=np.int32)
+        self.fg = np.zeros((0, 3, 3, 3), dtype=np.uint8)
+        self.bg = np.zeros((0, 3, 3, 3), dtype=np.uint8)
+        self.ids = {}
+        self.scratch = tcod.console.Console(3, 3, order="F")
+
+    def get_ids(self, module) -> Tuple[int, int, int]:
+        # one tile id per state, cached on the module until its props change
+        if module.tile_ids is None:
+            chunk = module.get_chunk()
+            key = (type(module), repr(chunk))
+            if key not in self.ids:
+                self.ids[key] = tuple(self.rasterize(chunk, state)
+                                      for state in STATES)
+            module.tile_ids = self.ids[key]
+        return module.tile_ids
+
+    def rasterize(self, chunk: base.Chunk, state: int) -> int:
+        con = self.scratch
+        con.default_fg = base.cols["fg"]
+        con.default_bg = base.cols["bg"]
+        con.clear()
+        fg, bg = state_cols[state]
+        draw_chunk(con, chunk, base.Vec2d(0, 0), fg=fg, bg=bg)
+        self.ch = np.concatenate([self.ch, con.ch[None]])
+        self.fg = np.concatenate([self.fg, con.fg[None]])
+        self.bg = np.concatenate([self.bg, con.bg[None]])
+        return len(self.ch) - 1
+
+
+cache = TileCache()
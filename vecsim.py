@@ -0,0 +1,169 @@
+from __future__ import annotations
+from typing import Tuple, Sequence, Dict, Set, FrozenSet
+import numpy as np
+import base
+import modules
+import pulse
+
+# direction codes, see base.dir_code
+DIRS = base.DIRS
+DX = np.array(base.DX, dtype=np.int32)
+DY = np.array(base.DY, dtype=np.int32)
+
+# module kinds on the type grid
+EMPTY = 0
+PASS = 1  # pulses move on unchanged (e.g. Emitter)
+SPREADER = 2
+OUTPUT = 3
+CUSTOM = 4  # unknown module, needs the object path
+SENTINEL = np.iinfo(np.int64).max
+
+kinds = {
+    modules.Empty: EMPTY,
+    modules.Emitter: PASS,
+    modules.Spreader: SPREADER,
+    modules.Output: OUTPUT,
+}
+
+
+class VectorSim():  # numpy backend for Board.update
+    board: 'board.Board'
+    # non-Empty cells only, sorted by key = x*board height + y and closed
+    # by an Empty sentinel that every lookup miss points to
+    keys: np.ndarray
+    kind: np.ndarray  # module kind per key
+    inmask: np.ndarray  # spreader inputs, one bit per direction code
+    outmask: np.ndarray  # spreader outputs, one bit per direction code
+    custom: Set[Tuple[int, int]]
+    xs: np.ndarray
+    ys: np.ndarray
+    ds: np.ndarray
+
+    def __init__(self, board: 'board.Board'):
+        self.board = board
+        placed = sorted(board.modules.items(),
+                        key=lambda item: self.key(*item[0]))
+        self.keys = np.array([self.key(x, y) for (x, y), mod in placed]
+                             + [SENTINEL], dtype=np.int64)
+        self.kind = np.array([kinds.get(type(mod), CUSTOM)
+                              for pos, mod in placed] + [EMPTY], dtype=np.int8)
+        self.inmask = np.array([base.dir_mask(getattr(mod, "inp", ()))
+                                for pos, mod in placed] + [0], dtype=np.uint8)
+        self.outmask = np.array([base.dir_mask(getattr(mod, "outp", ()))
+                                 for pos, mod in placed] + [0], dtype=np.uint8)
+        self.custom = set(pos for pos, mod in placed
+                          if kinds.get(type(mod), CUSTOM) == CUSTOM)
+        self.set_pulses(board.pulses)
+
+    def key(self, x, y):
+        return x*self.board.dim.y + y
+
+    def lookup(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        # index into keys per cell, the sentinel where the cell is Empty
+        keys = xs.astype(np.int64)*self.board.dim.y + ys
+        idx = np.searchsorted(self.keys, keys)
+        return np.where(self.keys[idx] == keys, idx, len(self.keys) - 1)
+
+    def on_cell_changed(self, pos: base.Vec2d):
+        mod = self.board.module_at(pos.x, pos.y)
+        kind = kinds.get(type(mod), CUSTOM)
+        key = self.key(pos.x, pos.y)
+        i = np.searchsorted(self.keys, key)
+        exists = self.keys[i] == key
+        if kind == EMPTY:
+            if exists:
+                self.keys = np.delete(self.keys, i)
+                self.kind = np.delete(self.kind, i)
+                self.inmask = np.delete(self.inmask, i)
+                self.outmask = np.delete(self.outmask, i)
+        else:
+            if not exists:
+                self.keys = np.insert(self.keys, i, key)
+                self.kind = np.insert(self.kind, i, 0)
+                self.inmask = np.insert(self.inmask, i, 0)
+                self.outmask = np.insert(self.outmask, i, 0)
+            self.kind[i] = kind
+            self.inmask[i] = base.dir_mask(getattr(mod, "inp", ()))
+            self.outmask[i] = base.dir_mask(getattr(mod, "outp", ()))
+        self.custom.discard((pos.x, pos.y))
+        if kind == CUSTOM:
+            self.custom.add((pos.x, pos.y))
+
+    def set_pulses(self, pulses: Sequence[pulse.Pulse]):
+        self.xs = np.array([p.pos.x for p in pulses], dtype=np.int32)
+        self.ys = np.array([p.pos.y for p in pulses], dtype=np.int32)
+        self.ds = np.array([base.dir_code(p.direction) for p in pulses],
+                           dtype=np.int8)
+
+    def get_pulses(self) -> Sequence[pulse.Pulse]:
+        return [pulse.Pulse(base.Vec2d(int(x), int(y)), DIRS[d])
+                for x, y, d in zip(self.xs, self.ys, self.ds)]
+
+    def get_pulse_positions(self) -> FrozenSet[Tuple[int, int]]:
+        return frozenset(zip(self.xs.tolist(), self.ys.tolist()))
+
+    def count(self) -> int:
+        return len(self.xs)
+
+    def update(self, beats: int):
+        if self.custom:
+            # custom modules only have on_pulse, so take the slow path
+            self.set_pulses(self.board.step_pulses(self.get_pulses(), beats))
+            return
+
+        xs, ys, ds = self.xs, self.ys, self.ds
+        # side effects first, in pulse order
+        for i in self.hits(xs, ys):
+            x, y = int(xs[i]), int(ys[i])
+            self.board.modules[(x, y)].on_pulse(
+                pulse.Pulse(base.Vec2d(x, y), DIRS[ds[i]]))
+        nx, ny, nd = self.dedup(*self.move(xs, ys, ds))
+        ex, ey, ed = self.emit(beats)
+        self.xs = np.concatenate([nx, ex]).astype(np.int32)
+        self.ys = np.concatenate([ny, ey]).astype(np.int32)
+        self.ds = np.concatenate([nd, ed]).astype(np.int8)
+
+    # the steps of update, separate for shardsim
+
+    def hits(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        # indices of the pulses on Output cells
+        return np.flatnonzero(self.kind[self.lookup(xs, ys)] == OUTPUT)
+
+    def move(self, xs: np.ndarray, ys: np.ndarray, ds: np.ndarray
+             ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # where the pulses go, duplicates included
+        idx = self.lookup(xs, ys)
+        kind = self.kind[idx]
+        # candidate outputs per pulse: slot 0 passes the pulse on, slots
+        # 1-4 are the spreader outputs in direction code order
+        accepts = (self.inmask[idx] >> ds.astype(np.uint8)) & 1
+        spread = np.where((kind == SPREADER) & (accepts == 1),
+                          self.outmask[idx], 0)
+        valid = np.empty((len(xs), 5), dtype=bool)
+        valid[:, 0] = (kind == EMPTY) | (kind == PASS)
+        for d in range(4):
+            valid[:, d+1] = (spread >> d) & 1
+        nd = np.empty((len(xs), 5), dtype=np.int8)
+        nd[:, 0] = ds
+        nd[:, 1:] = np.arange(4, dtype=np.int8)
+        nx = xs[:, None] + DX[nd]
+        ny = ys[:, None] + DY[nd]
+        valid &= (nx >= 0) & (nx < self.board.dim.x) & \
+            (ny >= 0) & (ny < self.board.dim.y)
+        return nx[valid], ny[valid], nd[valid]
+
+    def dedup(self, nx: np.ndarray, ny: np.ndarray, nd: np.ndarray
+              ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # drop duplicates, keeping the first occurrence like the object path
+        key = base.pulse_keys(nx, ny, nd, self.board.dim.y)
+        first = np.sort(np.unique(key, return_index=True)[1])
+        return nx[first], ny[first], nd[first]
+
+    def emit(self, beats: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # sources
+        emitted = []
+        for x, y in self.board.active_modules:
+            emitted += self.board.modules[(x, y)].on_beat(beats)
+        return (np.array([p.pos.x for p in emitted], dtype=np.int32),
+                np.array([p.pos.y for p in emitted], dtype=np.int32),
+                np.array([base.dir_code(p.direction) for p in emitted], dtype=np.int8))